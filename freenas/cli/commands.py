@@ -25,9 +25,13 @@
 #
 #####################################################################
 
+import io
 import os
 import inspect
 import sys
+import time
+import threading
+import contextlib
 import signal
 import select
 import readline
@@ -39,7 +43,7 @@ import logging
 import copy
 import getpass
 from datetime import datetime
-from freenas.cli.parser import Quote, parse, unparse, dump_ast
+from freenas.cli.parser import Quote, parse, parse_file, compile_file, unparse, dump_ast
 from freenas.cli.complete import NullComplete, EnumComplete
 from freenas.cli.namespace import (
     Command, PipeCommand, CommandException, description,
@@ -53,6 +57,7 @@ from freenas.cli.output import Object as output_obj, get_terminal_size
 from freenas.cli.descriptions.tasks import translate as translate_task
 from freenas.cli.utils import TaskPromise, describe_task_state, parse_timedelta, add_tty_formatting, quote, to_ascii
 from freenas.dispatcher.shell import ShellClient
+from freenas.utils import first_or_default
 from freenas.utils.url import wrap_address
 from urllib.parse import urlparse
 
@@ -65,6 +70,8 @@ if platform.system() != 'Windows':
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+WATCH_INTERVAL = 2
+
 logger = logging.getLogger('cli.commands')
 
 
@@ -954,17 +961,53 @@ class SourceCommand(Command):
                 arg = os.path.expanduser(arg)
                 if os.path.isfile(arg):
                     try:
-                        with open(arg, 'rb') as f:
-                            ast = parse(f.read().decode('utf8'), arg)
-                            context.eval_block(ast)
+                        ast = parse_file(arg)
                     except UnicodeDecodeError as e:
                         raise CommandException(_(
                             "Incorrect filetype, cannot parse file: {0}".format(str(e))
                         ))
+
+                    context.eval_block(ast)
                 else:
                     raise CommandException(_("File {0} does not exist.".format(arg)))
 
 
+@description("Precompile specified script")
+class CompileCommand(Command):
+    """
+    Usage: compile </path/filename>
+           compile </path/filename1> </path/filename2> </path/filename3>
+
+    Example: compile /mnt/mypool/myscript
+
+    Parse specified file or files and store the result next to each
+    file (with a "c" appended to its name). Subsequent 'source' runs
+    and clirc loading then skip parsing as long as the file has not
+    changed since it was compiled.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        if len(args) == 0:
+            raise CommandException(_("Please provide a filename. For help see 'help <command>'"))
+
+        result = []
+        for arg in args:
+            arg = os.path.expanduser(arg)
+            if not os.path.isfile(arg):
+                raise CommandException(_("File {0} does not exist.".format(arg)))
+
+            try:
+                result.append(_("Compiled {0} to {1}".format(arg, compile_file(arg))))
+            except UnicodeDecodeError as e:
+                raise CommandException(_(
+                    "Incorrect filetype, cannot parse file: {0}".format(str(e))
+                ))
+            except OSError as e:
+                raise CommandException(_("Cannot write compiled file for {0}: {1}".format(arg, str(e))))
+
+        return Sequence(*result)
+
+
 @description("Dump namespace configuration to a series of CLI commands")
 class DumpCommand(Command):
     """
@@ -1075,27 +1118,40 @@ class PendingCommand(Command):
 class WaitCommand(Command):
     """
     Usage: wait
-           wait <task ID>
+           wait <task ID> ...
+           wait all
 
     Example: wait
              wait 100
+             wait 100 101 102
+             wait all
 
-    Show task progress of either all waiting tasks or the
-    specified task. Use 'task show' to determine the task ID.
+    Show task progress of either the last submitted task, the specified
+    tasks or all pending tasks of this session. Use 'task show' to
+    determine the task ID.
     """
 
     def run(self, context, args, kwargs, opargs):
+        if args == ['all']:
+            tids = [t['id'] for t in context.pending_tasks.values() if t['parent'] is None and t['session'] == context.session_id]
+            if not tids:
+                return 'No pending tasks found'
+
+            return context.wait_for_tasks_with_progress(tids)
+
         if args:
             try:
-                tid = int(args[0])
+                tids = [int(i) for i in args]
             except ValueError:
                 raise CommandException('Task id argument must be an integer')
-        else:
-            tid = None
-            try:
-                tid = context.global_env.find('_last_task_id').value
-            except KeyError:
-                pass
+
+            return context.wait_for_tasks_with_progress(tids)
+
+        tid = None
+        try:
+            tid = context.global_env.find('_last_task_id').value
+        except KeyError:
+            pass
         if tid is None:
             return 'No recently submitted tasks (which are still active) found'
 
@@ -1153,6 +1209,154 @@ class TimeCommand(Command):
         return Sequence(*(result + [msg]))
 
 
+@description("Re-run a command and show how its output changes")
+class WatchCommand(Command):
+    """
+    Usage: watch [<interval>] `<code>`
+
+    Examples:
+        watch `task show`
+        watch 5 `volume show`
+
+    Evaluates <code> repeatedly and redraws only the parts of its output that
+    changed, highlighting them. When <code> only reads data the CLI already
+    receives as events (e.g. 'task show'), it is re-evaluated when those
+    events arrive instead of every <interval> seconds (2 by default), so
+    nothing is queried while nothing changes. Press ^C to stop.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        if not args or not isinstance(args[-1], Quote) or len(args) > 2:
+            raise CommandException(_("Provide code fragment to evaluate. For help see 'help watch'"))
+
+        interval = WATCH_INTERVAL
+        if len(args) == 2:
+            if not isinstance(args[0], (int, float)) or args[0] <= 0:
+                raise CommandException(_("Interval has to be a positive number of seconds"))
+
+            interval = args[0]
+
+        body = args[-1].body
+        changed = threading.Event()
+        watched = {}
+        previous = None
+        highlighted = set()
+
+        def notify(*args):
+            changed.set()
+
+        try:
+            while True:
+                sources, lines = self.evaluate(context, body)
+                for name in sources:
+                    subscriber = context.entity_subscribers.get(name)
+                    if subscriber and watched.get(name) is not subscriber:
+                        subscriber.on_add.add(notify)
+                        subscriber.on_update.add(notify)
+                        subscriber.on_delete.add(notify)
+                        watched[name] = subscriber
+
+                header = _("{0}: {1}    {2:%H:%M:%S}").format(
+                    _("On change") if sources else _("Every {0}s").format(interval),
+                    '; '.join(unparse(t, oneliner=True) for t in body),
+                    datetime.now()
+                )
+
+                highlighted = self.draw(header, lines, previous, highlighted)
+                previous = lines
+
+                if sources:
+                    # Wait for the first event, then give related ones a moment to arrive too
+                    while not changed.wait(0.5):
+                        pass
+
+                    time.sleep(context.variables.get('notification_interval') / 1000)
+                    changed.clear()
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for subscriber in watched.values():
+                subscriber.on_add.discard(notify)
+                subscriber.on_update.discard(notify)
+                subscriber.on_delete.discard(notify)
+
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+    @staticmethod
+    def evaluate(context, body):
+        """
+        Returns the output of ``body`` as a list of lines, and the names of
+        the entity subscribers it was computed from. The latter is empty if
+        the command also made RPC calls, since those can't be watched.
+        """
+        rpc_calls = context.connection.calls
+        buffer = io.StringIO()
+        # While recording, large namespaces answer from their subscribers
+        # instead of paging from the server
+        with context.entity_subscribers.record() as used:
+            with contextlib.redirect_stdout(buffer):
+                for i in context.eval(body):
+                    if i is not None:
+                        format_output(i, file=buffer)
+
+        sources = used if context.connection.calls == rpc_calls else set()
+        return sources, buffer.getvalue().splitlines()
+
+    @staticmethod
+    def draw(header, lines, previous, highlighted):
+        """
+        Draws a frame and returns the indexes of lines left highlighted, which
+        are drawn plain again in the next frame unless they change again. The
+        header, holding the time of the last evaluation, is redrawn on every
+        frame; output that is not a tty only gets frames that changed.
+        """
+        if not sys.stdout.isatty():
+            if lines != previous:
+                sys.stdout.write('\n'.join([header, ''] + lines) + '\n')
+                sys.stdout.flush()
+
+            return set()
+
+        height, width = get_terminal_size()
+        lines = [line[:width] for line in lines[:height - 3]]
+        if previous is None:
+            sys.stdout.write('\x1b[2J\x1b[H{0}\n\n{1}'.format(header, '\n'.join(lines)))
+            sys.stdout.flush()
+            return set()
+
+        previous = [line[:width] for line in previous[:height - 3]]
+        out = ['\x1b[1;1H{0}\x1b[K'.format(header)]
+        changed = set()
+        for idx, line in enumerate(lines):
+            old = previous[idx] if idx < len(previous) else ''
+            if line == old:
+                if idx in highlighted:
+                    out.append('\x1b[{0};1H{1}\x1b[K'.format(idx + 3, line))
+
+                continue
+
+            # Highlight the characters that differ from the previous frame
+            chars = []
+            for pos, char in enumerate(line):
+                if pos >= len(old) or old[pos] != char:
+                    chars.append('\x1b[7m{0}\x1b[0m'.format(char))
+                else:
+                    chars.append(char)
+
+            out.append('\x1b[{0};1H{1}\x1b[K'.format(idx + 3, ''.join(chars)))
+            changed.add(idx)
+
+        if len(lines) < len(previous):
+            out.append('\x1b[{0};1H\x1b[J'.format(len(lines) + 3))
+
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
+        return changed
+
+
 class RemoteCommand(Command):
     """
     Usage: remote `<code>`
@@ -1188,7 +1392,12 @@ class MorePipeCommand(PipeCommand):
         self.must_be_last = True
 
     def run(self, context, args, kwargs, opargs, input=None):
-        output_less(lambda x: format_output(input, file=x))
+        if not output_less(lambda x: format_output(input, file=x)):
+            # Pager was closed early, stop the upstream query if it streams
+            close = getattr(getattr(input, 'data', input), 'close', None)
+            if close:
+                close()
+
         return None
 
 
@@ -1406,22 +1615,50 @@ class LimitPipeCommand(PipeCommand):
         return input
 
 
-@description("Display output of the specific field")
+@description("Display output of the specific fields")
 class SelectPipeCommand(PipeCommand):
     """
     Usage: <command> | select <field>
+           <command> | select <field>,<field>,...
 
     Example: account user show | select name
+             account user show | select name,uid,home
 
-    Return only the output of the specified field. Use 'help properties' to
-    determine the valid field (Property) names for a namespace.
+    Return only the output of the specified field. When several fields
+    are given, a table consisting of just those columns is returned.
+    Use 'help properties' to determine the valid field (Property) names
+    for a namespace.
     """
 
+    @staticmethod
+    def fields(args):
+        fields = []
+        for i in args:
+            fields.extend(i if isinstance(i, list) else [i])
+
+        if len(fields) == 0:
+            raise CommandException('Please specify at least one field name')
+
+        return fields
+
+    def serialize_filter(self, context, args, kwargs, opargs):
+        return {"params": {"select": self.fields(args)}}
+
     def run(self, context, args, kwargs, opargs, input=None):
-        if len(args) != 1:
-            raise CommandException('Please specify exactly one field name')
+        fields = self.fields(args)
 
         if isinstance(input, Table):
-            result = Table(None, [Table.Column('Result', 'result')])
-            result.data = ({'result': x.get(args[0])} for x in input)
-            return result
+            if len(fields) == 1:
+                result = Table(None, [Table.Column('Result', 'result')])
+                result.data = ({'result': x.get(fields[0])} for x in input)
+                return result
+
+            columns = []
+            for f in fields:
+                column = first_or_default(lambda c: c.name == f, input.columns)
+                if not column:
+                    raise CommandException('Field {0} not found'.format(f))
+
+                columns.append(column)
+
+            return Table(input.data, columns)
@@ -25,16 +25,201 @@
 #
 #####################################################################
 
+import time
+import bisect
+import threading
+import collections
+from freenas.utils import query as q
 from freenas.cli.output import format_value
 from freenas.cli.utils import quote
 from copy import deepcopy
 
 
+RPC_COMPLETE_TTL = 30
+
+
+def callable_key(fn):
+    """
+    Identifies a mapper by its code and the values it closes over, so that
+    two lambdas created from different arguments don't share a cache entry.
+    """
+    if fn is None:
+        return None
+
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return repr(fn)
+
+    cells = []
+    for cell in getattr(fn, '__closure__', None) or ():
+        try:
+            cells.append(repr(cell.cell_contents))
+        except ValueError:
+            cells.append(None)
+
+    return (code.co_filename, code.co_firstlineno, code.co_name, tuple(cells))
+
+
+class PrefixIndex(object):
+    """
+    Sorted set of candidates, searchable by prefix with bisect. Candidates
+    are kept as strings; None is left out.
+    """
+    def __init__(self, items=()):
+        self.items = sorted(set(str(i) for i in items if i is not None))
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if item is None:
+            return
+
+        item = str(item)
+        i = bisect.bisect_left(self.items, item)
+        if i == len(self.items) or self.items[i] != item:
+            self.items.insert(i, item)
+
+    def remove(self, item):
+        if item is None:
+            return
+
+        item = str(item)
+        i = bisect.bisect_left(self.items, item)
+        if i < len(self.items) and self.items[i] == item:
+            del self.items[i]
+
+    def search(self, prefix):
+        lo = bisect.bisect_left(self.items, prefix)
+        hi = bisect.bisect_left(self.items, prefix + '\U0010ffff', lo)
+        return self.items[lo:hi]
+
+
+class CompletionCache(object):
+    """
+    Caches completion choices keyed on (namespace path, command, argument
+    slot) and the configuration of the completer itself, which may depend on
+    other arguments of the command. Entries of subscriber based completers
+    are dropped as soon as the subscriber reports a change, entries of RPC
+    based ones expire after their TTL.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.keys = collections.defaultdict(set)
+        self.generations = collections.Counter()
+        self.subscribers = {}
+        self.indexes = {}
+
+    def complete(self, key, completion, context, token, prefix):
+        if not completion.cacheable or not all(self.watch(context, s) for s in completion.sources()):
+            return completion.choices(context, token)
+
+        # Completers are built from the arguments typed so far, so their
+        # configuration is part of the key
+        key = tuple(key) + completion.cache_key()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and (entry[0] is None or entry[0] > now):
+                return entry[1].search(prefix)
+
+            generations = [self.generations[s] for s in completion.sources()]
+
+        index = PrefixIndex(completion.choices(context, token))
+        with self.lock:
+            # Don't store choices computed from data that changed meanwhile
+            if generations == [self.generations[s] for s in completion.sources()]:
+                for k in [k for k, v in self.entries.items() if v[0] is not None and v[0] <= now]:
+                    del self.entries[k]
+
+                self.entries[key] = (now + completion.ttl if completion.ttl else None, index)
+                for s in completion.sources():
+                    self.keys[s].add(key)
+
+        return index.search(prefix)
+
+    def watch(self, context, source):
+        subscriber = context.entity_subscribers.get(source)
+        if not subscriber:
+            return False
+
+        with self.lock:
+            if self.subscribers.get(source) is subscriber:
+                return True
+
+            self.subscribers[source] = subscriber
+
+        # New or restarted subscriber; anything cached before is stale
+        self.invalidate(source)
+        with self.lock:
+            for i in [k for k in self.indexes if k[0] == source]:
+                del self.indexes[i]
+
+        subscriber.on_add.add(lambda entity: self.changed(source, None, entity))
+        subscriber.on_update.add(lambda old, new: self.changed(source, old, new))
+        subscriber.on_delete.add(lambda entity: self.changed(source, entity, None))
+        return True
+
+    def index(self, context, source, params, key):
+        """
+        Returns a PrefixIndex of the ``key`` field of all entities of the
+        ``source`` subscriber matching ``params``. The index is updated
+        incrementally from the subscriber's change events.
+        """
+        if not self.watch(context, source):
+            return None
+
+        ikey = (source, repr(params), key)
+        with self.lock:
+            entry = self.indexes.get(ikey)
+            if entry:
+                return entry[2]
+
+            generation = self.generations[source]
+
+        subscriber = context.entity_subscribers[source]
+        subscriber.wait_ready()
+        index = PrefixIndex(subscriber.query(*params, callback=lambda o: q.get(o, key)))
+        with self.lock:
+            if generation == self.generations[source]:
+                self.indexes[ikey] = (params, key, index)
+
+        return index
+
+    def changed(self, source, old, new):
+        self.invalidate(source)
+        with self.lock:
+            indexes = [v for k, v in self.indexes.items() if k[0] == source]
+
+        for params, key, index in indexes:
+            if old is not None and q.query([old], *params, single=True):
+                index.remove(q.get(old, key))
+
+            if new is not None and q.query([new], *params, single=True):
+                index.add(q.get(new, key))
+
+    def invalidate(self, source):
+        with self.lock:
+            self.generations[source] += 1
+            for key in self.keys.pop(source, ()):
+                self.entries.pop(key, None)
+
+
 class NullComplete(object):
+    cacheable = False
+    ttl = None
+
     def __init__(self, name, **kwargs):
         self.name = name
         self.list = kwargs.pop('list', False)
 
+    def sources(self):
+        return ()
+
+    def cache_key(self):
+        return ()
+
     def choices(self, context, token):
         return []
 
@@ -49,6 +234,8 @@ class EnumComplete(NullComplete):
 
 
 class EntitySubscriberComplete(NullComplete):
+    cacheable = True
+
     def __init__(self, name, datasource, mapper=None, extra=None, filter=None, **kwargs):
         super(EntitySubscriberComplete, self).__init__(name, **kwargs)
         self.datasource = datasource
@@ -56,6 +243,12 @@ class EntitySubscriberComplete(NullComplete):
         self.extra = extra or []
         self.filter = filter or []
 
+    def sources(self):
+        return (self.datasource,)
+
+    def cache_key(self):
+        return (self.datasource, repr(self.filter), repr(self.extra), callable_key(self.mapper))
+
     def choices(self, context, token):
         return context.entity_subscribers[self.datasource].query(*self.filter, callback=self.mapper) + self.extra
 
@@ -63,8 +256,15 @@ class EntitySubscriberComplete(NullComplete):
 class RpcComplete(EntitySubscriberComplete):
     def __init__(self, name, datasource, mapper=None, extra=None, call_args=None, **kwargs):
         self.call_args = call_args
+        self.ttl = kwargs.pop('ttl', RPC_COMPLETE_TTL)
         super(RpcComplete, self).__init__(name, datasource, mapper, extra, **kwargs)
 
+    def sources(self):
+        return ()
+
+    def cache_key(self):
+        return super(RpcComplete, self).cache_key() + (repr(self.call_args),)
+
     def choices(self, context, token):
         result = deepcopy(self.extra)
         datasource = context.call_sync(self.datasource, *(self.call_args or ()))
@@ -101,6 +301,15 @@ class MultipleSourceComplete(NullComplete):
         super(MultipleSourceComplete, self).__init__(name, **kwargs)
         self.components = components
         self.extra = extra or []
+        self.cacheable = all(c.cacheable for c in components)
+        ttls = [c.ttl for c in components if c.ttl]
+        self.ttl = min(ttls) if ttls else None
+
+    def sources(self):
+        return tuple(s for c in self.components for s in c.sources())
+
+    def cache_key(self):
+        return (repr(self.extra),) + tuple(c.cache_key() for c in self.components)
 
     def choices(self, context, token):
         result = deepcopy(self.extra)
@@ -28,12 +28,62 @@
 import os
 import sys
 import tty
+import time
+import atexit
+import codecs
 import curses
 import termios
 import select
-from threading import Thread
+import gettext
+from threading import Thread, Condition, Event, Lock
 from urllib.parse import urlparse
 from freenas.dispatcher.shell import VMConsoleClient
+from freenas.cli.namespace import CommandException
+
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+
+READ_CHUNK_SIZE = 64 * 1024
+CAPTURE_BUFFER_SIZE = 1024 * 1024
+CAPTURE_FLUSH_INTERVAL = 1
+CAPTURE_KEEP = 5
+
+
+def prefix_fallback(seq):
+    """
+    For each length n of a partial match of ``seq``, returns the length of
+    the longest proper suffix of seq[:n] that is also a prefix of ``seq``,
+    i.e. how much of a partial match survives a mismatch.
+    """
+    fallback = [0] * (len(seq) + 1)
+    k = 0
+    for idx in range(1, len(seq)):
+        while k and seq[idx] != seq[k]:
+            k = fallback[k]
+
+        if seq[idx] == seq[k]:
+            k += 1
+
+        fallback[idx + 1] = k
+
+    return fallback
+
+
+def open_console(context, id, on_data, on_close):
+    token = context.call_sync('containerd.console.request_console', id)
+    port = 80
+    path = 'containerd/console'
+    if urlparse(context.uri).scheme == 'unix':
+        path = 'console'
+        port = 5500
+
+    conn = VMConsoleClient(context.hostname, token, port, path)
+    conn.on_data(on_data)
+    conn.on_close(on_close)
+    conn.open()
+    return conn
 
 
 class Console(object):
@@ -44,11 +94,19 @@ class Console(object):
         self.stdscr = None
         eseq = bytes(self.context.variables.get('vm.console_interrupt'), 'utf-8').decode('unicode_escape')
         self.esbytes = bytes(eseq, 'utf-8')
+        self.esfallback = prefix_fallback(self.esbytes)
+        self.esidx = 0
         self.eof_r, self.eof_w = os.pipe()
+        self.output = bytearray()
+        self.output_cv = Condition()
+        self.closed = False
 
     def on_data(self, data):
-        sys.stdout.buffer.write(data)
-        sys.stdout.buffer.flush()
+        # Data is written out by the writer thread; whatever arrives while
+        # it is busy writing goes out together with the next write
+        with self.output_cv:
+            self.output += data
+            self.output_cv.notify()
 
     def on_close(self):
         try:
@@ -56,27 +114,78 @@ class Console(object):
         except OSError:
             pass
 
+    def writer(self):
+        stdout_fd = sys.stdout.fileno()
+        while True:
+            with self.output_cv:
+                while not self.output and not self.closed:
+                    self.output_cv.wait()
+
+                if not self.output:
+                    return
+
+                data = bytes(self.output)
+                self.output.clear()
+
+            while data:
+                try:
+                    written = os.write(stdout_fd, data)
+                except BlockingIOError:
+                    select.select([], [stdout_fd], [])
+                    continue
+
+                data = data[written:]
+
     def connect(self):
-        token = self.context.call_sync('containerd.console.request_console', self.id)
-        port = 80
-        path = 'containerd/console'
-        if urlparse(self.context.uri).scheme == 'unix':
-            path = 'console'
-            port = 5500
-
-        self.conn = VMConsoleClient(self.context.hostname, token, port, path)
-        self.conn.on_data(self.on_data)
-        self.conn.on_close(self.on_close)
-        self.conn.open()
+        self.conn = open_console(self.context, self.id, self.on_data, self.on_close)
 
-    def start(self):
-        # process escape characters using runtime
-        eslen = len(self.esbytes)
-        esidx = 0   # stack pointer for sequence match...
+    def scan(self, data):
+        """
+        Splits a chunk of input at the escape sequence, which may span
+        several chunks. Returns the bytes to forward and whether the escape
+        sequence was completed.
+        """
+        if not self.esbytes:
+            return bytes(data), False
 
+        out = bytearray()
+        first = self.esbytes[:1]
+        i = 0
+        while i < len(data):
+            if self.esidx == 0:
+                j = data.find(first, i)
+                if j < 0:
+                    out += data[i:]
+                    break
+
+                out += data[i:j]
+                i = j
+
+            if data[i] == self.esbytes[self.esidx]:
+                self.esidx += 1
+                i += 1
+                if self.esidx == len(self.esbytes):
+                    self.esidx = 0
+                    return bytes(out), True
+            else:
+                # Not the escape sequence after all; forward what was held
+                # back, except for a tail that may still start it, and look
+                # at the current byte again
+                keep = self.esfallback[self.esidx]
+                out += self.esbytes[:self.esidx - keep]
+                self.esidx = keep
+
+        return bytes(out), False
+
+    def start(self):
         stdin_fd = sys.stdin.fileno()
         r_list = [stdin_fd, self.eof_r]
         old_stdin_settings = termios.tcgetattr(stdin_fd)
+        sys.stdout.flush()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        writer_t = Thread(target=self.writer)
+        writer_t.daemon = True
+        writer_t.start()
         try:
             tty.setraw(stdin_fd)
             connect_t = Thread(target=self.connect)
@@ -86,27 +195,207 @@ class Console(object):
                 r, w, x = select.select(r_list, [], [])
 
                 if stdin_fd in r:
-                    ch = sys.stdin.read(1)
-                    bch = bytes(ch, 'utf-8')[0]
-
-                    if self.esbytes[esidx] == bch:
-                        esidx += 1
-                        if esidx == eslen:
-                            self.conn.close()
-                            break
-                    elif esidx > 0:
-                        # reset stack pointer...no match
-                        # BW: possibly write out characters up to this point if sequence not matched?
-                        #     or maybe we write the chars all along?
-                        esidx = 0
-                    else:
-                        self.conn.write(ch)
+                    # Take everything available at once, so pasted text is
+                    # sent in a few large writes rather than per character
+                    data, escaped = self.scan(os.read(stdin_fd, READ_CHUNK_SIZE))
+                    text = decoder.decode(data)
+                    if text and self.conn:
+                        self.conn.write(text)
+
+                    if escaped:
+                        self.conn.close()
+                        break
 
                 if self.eof_r in r:
                     self.conn.close()
                     break
         finally:
+            with self.output_cv:
+                self.closed = True
+                self.output_cv.notify()
+
+            writer_t.join()
             termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_stdin_settings)
             curses.wrapper(lambda x: x)
             os.close(self.eof_r)
             os.close(self.eof_w)
+
+
+class ConsoleCapture(object):
+    """
+    Streams the output of a console to a file, or to stdout when no path
+    is given, without touching the terminal. Writes to a file go through a
+    large buffer which a background thread flushes every
+    CAPTURE_FLUSH_INTERVAL seconds; stdout is flushed after every write.
+    With ``rotate`` set, the file is rotated once it reaches that many
+    bytes, keeping ``keep`` old files as <path>.1 ... <path>.<keep>, or
+    just truncated if ``keep`` is 0.
+    """
+    captures = {}
+    lock = Lock()
+
+    def __init__(self, context, id, name, path=None, rotate=None, keep=CAPTURE_KEEP):
+        self.context = context
+        self.id = id
+        self.name = name
+        self.path = path
+        self.rotate = rotate
+        self.keep = keep
+        self.conn = None
+        self.file = None
+        self.written = 0
+        self.dirty = False
+        self.file_lock = Lock()
+        self.closed = Event()
+
+    @classmethod
+    def get(cls, id):
+        with cls.lock:
+            return cls.captures.get(id)
+
+    @classmethod
+    def stop_all(cls):
+        with cls.lock:
+            captures = list(cls.captures.values())
+
+        for i in captures:
+            i.stop()
+
+    def open_file(self):
+        if not self.path:
+            return sys.stdout.buffer
+
+        f = open(self.path, 'ab', buffering=CAPTURE_BUFFER_SIZE)
+        self.written = f.tell()
+        return f
+
+    def rotate_file(self):
+        if not self.keep:
+            self.file.flush()
+            self.file.truncate(0)
+            self.written = 0
+            return
+
+        self.file.close()
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists('{0}.{1}'.format(self.path, i)):
+                os.replace('{0}.{1}'.format(self.path, i), '{0}.{1}'.format(self.path, i + 1))
+
+        os.replace(self.path, '{0}.1'.format(self.path))
+        self.file = self.open_file()
+
+    def flush_loop(self):
+        while not self.closed.wait(CAPTURE_FLUSH_INTERVAL):
+            with self.file_lock:
+                if self.file and self.dirty:
+                    self.file.flush()
+                    self.dirty = False
+
+    def on_data(self, data):
+        with self.file_lock:
+            if not self.file:
+                return
+
+            self.file.write(data)
+            self.written += len(data)
+            if self.rotate and self.written >= self.rotate:
+                self.rotate_file()
+
+            if self.path:
+                self.dirty = True
+            else:
+                self.file.flush()
+
+    def on_close(self):
+        with self.file_lock:
+            if self.file:
+                self.file.flush()
+                if self.path:
+                    self.file.close()
+
+                self.file = None
+
+        with self.lock:
+            if self.captures.get(self.id) is self:
+                del self.captures[self.id]
+
+        self.closed.set()
+
+    def start(self):
+        with self.lock:
+            if self.id in self.captures:
+                return False
+
+            self.captures[self.id] = self
+
+        try:
+            self.file = self.open_file()
+            self.conn = open_console(self.context, self.id, self.on_data, self.on_close)
+            if self.path:
+                Thread(target=self.flush_loop, daemon=True).start()
+        except BaseException:
+            self.on_close()
+            raise
+
+        return True
+
+    def stop(self):
+        if self.conn:
+            self.conn.close()
+
+        self.on_close()
+
+    def wait(self):
+        # Wait in short steps so that ^C gets through
+        while not self.closed.wait(0.5):
+            pass
+
+
+def capture_console(context, id, name, args, kwargs):
+    """
+    Implements the non-interactive modes of console commands:
+    ``save=<path> [rotate=<size>] [keep=<n>]`` starts capturing to a file in
+    the background, ``follow`` streams to stdout until the console closes or
+    ^C is pressed, and ``stop`` ends a background capture. Returns False if
+    none of them was requested.
+    """
+    if 'stop' in args:
+        capture = ConsoleCapture.get(id)
+        if not capture:
+            raise CommandException(_("Console output of {0} is not being saved".format(name)))
+
+        capture.stop()
+        return _("Stopped saving console output of {0} to {1}".format(name, capture.path))
+
+    if 'follow' in args:
+        capture = ConsoleCapture(context, id, name)
+        if not capture.start():
+            raise CommandException(_("Console output of {0} is already being captured".format(name)))
+
+        try:
+            capture.wait()
+        except KeyboardInterrupt:
+            capture.stop()
+
+        return None
+
+    if 'save' in kwargs:
+        rotate = kwargs.get('rotate')
+        keep = kwargs.get('keep', CAPTURE_KEEP)
+        if rotate is not None and (not isinstance(rotate, int) or rotate <= 0):
+            raise CommandException(_("rotate has to be a positive size, e.g. rotate=100MB"))
+
+        if not isinstance(keep, int) or keep < 0:
+            raise CommandException(_("keep has to be a non-negative number"))
+
+        path = os.path.abspath(os.path.expanduser(kwargs['save']))
+        capture = ConsoleCapture(context, id, name, path, rotate, keep)
+        if not capture.start():
+            raise CommandException(_("Console output of {0} is already being captured".format(name)))
+
+        return _("Saving console output of {0} to {1} in the background. Use 'stop' to end it".format(name, path))
+
+    return False
+
+
+atexit.register(ConsoleCapture.stop_all)
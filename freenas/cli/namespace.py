@@ -27,6 +27,7 @@
 
 import re
 import copy
+import time
 import traceback
 import errno
 import gettext
@@ -38,7 +39,7 @@ import inspect
 import contextlib
 from freenas.utils import first_or_default, query as q, extend
 from freenas.cli.parser import CommandCall, Literal, Symbol, BinaryParameter, Comment
-from freenas.cli.complete import NullComplete, EnumComplete
+from freenas.cli.complete import NullComplete, EnumComplete, PrefixIndex, RPC_COMPLETE_TTL
 from freenas.cli.utils import post_save, edit_in_editor, PrintableNone, TaskPromise, EntityPromise
 from freenas.cli.output import (
     ValueType, Object, Table, Sequence,
@@ -48,6 +49,9 @@ from freenas.cli.output import (
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+LARGE_NAMESPACE_COMPLETE_LIMIT = 1000
+QUERY_PAGE_SIZE = 1000
+
 
 def description(descr):
     def wrapped(fn):
@@ -142,6 +146,16 @@ class Command(object):
     def complete(self, context, **kwargs):
         return []
 
+    def completions(self, context):
+        """
+        Argument-less complete() result, built once per command instance.
+        """
+        completions = getattr(self, '_completions', None)
+        if completions is None:
+            completions = self._completions = self.complete(context)
+
+        return completions
+
     def convert_exec_path_to_strings(self):
         return [e.name if isinstance(e, Namespace) else e for e in self.exec_path]
 
@@ -984,10 +998,29 @@ class BaseListCommand(FilteringCommand):
                     v = dummy_entity[prop.get_name]
                 yield prop.get_name, op, v
 
+    def __projection(self, mappings):
+        # Only plain getters can be pushed down; computed getters and
+        # conditions may read any field of the entity
+        if not self.parent.projection:
+            return None
+
+        fields = []
+        for prop in mappings + [self.parent.primary_key]:
+            if prop is None:
+                continue
+
+            if not isinstance(prop.get, six.string_types) or prop.condition:
+                return None
+
+            if prop.get not in fields:
+                fields.append(prop.get)
+
+        return fields
+
     def run(self, context, args, kwargs, opargs, filtering=None):
-        cols = []
         params = []
         options = {}
+        select = None
 
         if filtering:
             for k, v in filtering['params'].items():
@@ -995,6 +1028,10 @@ class BaseListCommand(FilteringCommand):
                     options['limit'] = int(v)
                     continue
 
+                if k == 'select':
+                    select = v
+                    continue
+
                 if k == 'reverse':
                     options['reverse'] = v
                     continue
@@ -1020,12 +1057,22 @@ class BaseListCommand(FilteringCommand):
 
             params = list(self.__map_filter_properties(filtering['filter']))
 
-        for col in self.parent.property_mappings:
-            if not col.list:
-                continue
+        if select:
+            mappings = []
+            for name in select:
+                prop = self.parent.get_mapping(name)
+                if not prop:
+                    raise CommandException('Field {0} not found'.format(name))
+
+                mappings.append(prop)
+        else:
+            mappings = [col for col in self.parent.property_mappings if col.list]
 
-            cols.append(Table.Column(col.descr, col.do_get, col.type, col.width, col.name))
+        fields = self.__projection(mappings)
+        if fields:
+            options['select'] = fields
 
+        cols = [Table.Column(col.descr, col.do_get, col.type, col.width, col.name) for col in mappings]
         return Table(self.parent.query(params, options), cols)
 
 
@@ -1170,6 +1217,11 @@ class EntityNamespace(Namespace):
         self.skeleton_entity = {}
         self.entity_localdoc = {}
         self.large = False
+        # Have show select only the columns it lists. Large namespaces opt
+        # in, as they page through the server; the rest are small or listed
+        # from memory
+        self.projection = False
+        self.skip_entity_namespaces = False
         self.has_entities_in_subnamespaces_only = False
 
     def has_property(self, prop):
@@ -1217,13 +1269,120 @@ class EntityNamespace(Namespace):
             return SingleItemNamespace(name, self, self.context)
 
     def namespaces(self, name=None):
-        if self.primary_key is None or self.large:
+        if self.primary_key is None or self.large or self.skip_entity_namespaces:
             return
 
         for i in self.query([], {'limit': 100}):
             name = self.primary_key.do_get(i)
             yield SingleItemNamespace(name, self, self.context)
 
+    @contextlib.contextmanager
+    def static_namespaces(self):
+        """
+        Makes namespaces() leave out per-entity namespaces, which
+        complete_names() provides in full.
+        """
+        self.skip_entity_namespaces = True
+        try:
+            yield
+        finally:
+            self.skip_entity_namespaces = False
+
+    def complete_names(self, prefix):
+        if self.primary_key is None:
+            return []
+
+        if self.large:
+            # Let the server do the matching instead of fetching everything
+            if not isinstance(self.primary_key.get, six.string_types):
+                return []
+
+            result = self.query(
+                [(self.primary_key.get, '~', '^' + re.escape(prefix))],
+                {'limit': LARGE_NAMESPACE_COMPLETE_LIMIT}
+            )
+        else:
+            result = self.query([], {})
+
+        names = (self.primary_key.do_get(i) for i in result)
+        return [n for n in names if isinstance(n, six.string_types) and n.startswith(prefix)]
+
+
+def unproject(result, fields):
+    """
+    Turns rows returned by a query with the ``select`` option back into
+    (partial) entity dicts keyed by the selected field paths. Entities
+    returned whole by a query ignoring ``select`` are passed through.
+    """
+    if not fields:
+        return result
+
+    ret = []
+    for values in result:
+        if isinstance(values, dict):
+            ret.append(values)
+            continue
+
+        obj = {}
+        for path, value in zip(fields, values):
+            ptr = obj
+            *parents, key = path.split('.')
+            for i in parents:
+                ptr = ptr.setdefault(i, {})
+
+            ptr[key] = value
+
+        ret.append(obj)
+
+    return ret
+
+
+def page_query(context, call, params, options, primary_key=None, **kwargs):
+    """
+    Runs a query RPC lazily, one page of QUERY_PAGE_SIZE rows at a time, so
+    that output can start with the first page and consumers stopping early
+    (head, pagers) never fetch the rest. Results ordered by the primary key
+    are paged by key, anything else by offset. Bounded or reversed queries
+    are done in a single call.
+    """
+    select = options.get('select')
+    if options.get('limit') or options.get('reverse'):
+        return unproject(context.call_sync(call, params, options, **kwargs), select)
+
+    sort = options.get('sort') or []
+    keyset = primary_key and sort in ([], [primary_key], ['-' + primary_key])
+    if keyset and select and primary_key not in select:
+        keyset = False
+
+    def page():
+        offset = 0
+        last = None
+        while True:
+            if keyset:
+                page_params = params
+                if last is not None:
+                    page_params = params + [(primary_key, '<' if sort and sort[0][0] == '-' else '>', last)]
+
+                ret = context.call_sync(call, page_params, extend(options, {
+                    'sort': sort or [primary_key],
+                    'limit': QUERY_PAGE_SIZE
+                }), **kwargs)
+            else:
+                ret = context.call_sync(call, params, extend(options, {
+                    'offset': offset,
+                    'limit': QUERY_PAGE_SIZE
+                }), **kwargs)
+
+            ret = unproject(ret, select)
+            yield from ret
+            if len(ret) < QUERY_PAGE_SIZE:
+                return
+
+            offset += len(ret)
+            last = q.get(ret[-1], primary_key)
+
+    return page()
+
 
 class RpcBasedLoadMixin(object):
     def __init__(self, *args, **kwargs):
@@ -1232,14 +1391,25 @@ class RpcBasedLoadMixin(object):
         self.extra_query_params = []
         self.extra_query_options = {}
         self.call_timeout = 30
+        self.names_cache = None
 
     def query(self, params, options):
-        return self.context.call_sync(
+        if self.large:
+            return page_query(
+                self.context,
+                self.query_call,
+                self.extra_query_params + params,
+                extend(self.extra_query_options, options),
+                self.primary_key_name,
+                timeout=self.call_timeout
+            )
+
+        return unproject(self.context.call_sync(
             self.query_call,
             self.extra_query_params + params,
             extend(self.extra_query_options, options),
             timeout=self.call_timeout
-        )
+        ), options.get('select'))
 
     def get_one(self, name):
         return self.context.call_sync(
@@ -1249,12 +1419,26 @@ class RpcBasedLoadMixin(object):
             timeout=self.call_timeout
         )
 
+    def complete_names(self, prefix):
+        if self.large or self.primary_key is None or not isinstance(self.primary_key.get, six.string_types):
+            return super(RpcBasedLoadMixin, self).complete_names(prefix)
+
+        # Names are fetched once per RPC_COMPLETE_TTL rather than on every Tab
+        now = time.monotonic()
+        if not self.names_cache or self.names_cache[0] <= now:
+            options = {'select': [self.primary_key.get]} if self.projection else {}
+            names = (self.primary_key.do_get(i) for i in self.query([], options))
+            self.names_cache = (now + RPC_COMPLETE_TTL, PrefixIndex(names))
+
+        return self.names_cache[1].search(prefix)
+
 
 class EntitySubscriberBasedLoadMixin(object):
     def __init__(self, *args, **kwargs):
         super(EntitySubscriberBasedLoadMixin, self).__init__(*args, **kwargs)
         self.primary_key_name = 'id'
         self.entity_subscriber_name = None
+        self.history_query_call = None
         self.extra_query_params = []
 
     def on_enter(self, *args, **kwargs):
@@ -1283,20 +1467,74 @@ class EntitySubscriberBasedLoadMixin(object):
 
         if not self.context.docgen_run:
             self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
-            return self.context.entity_subscribers[self.entity_subscriber_name].query(
+            if self.history_query_call and self.context.history_retention.is_truncated(self.entity_subscriber_name):
+                return self.query_history(params, options)
+
+            if self.large and not options.get('limit') and not self.context.entity_subscribers.recording:
+                # Stream straight from the server rather than copying and sorting the whole collection.
+                # Not while watch records subscriber use: it re-evaluates on events instead of polling.
+                return page_query(
+                    self.context,
+                    '{0}.query'.format(self.entity_subscriber_name),
+                    self.extra_query_params + params,
+                    options,
+                    self.primary_key_name
+                )
+
+            return unproject(self.context.entity_subscribers[self.entity_subscriber_name].query(
                 *(self.extra_query_params + params),
                 **options
-            )
+            ), options.get('select'))
         else:
             return {}
 
+    def query_history(self, params, options):
+        """
+        Queries a subscriber truncated by history retention. Requests for
+        the newest ``limit`` entities are still served from memory, anything
+        else is fetched from the server page by page.
+        """
+        params = self.extra_query_params + params
+        sort = options.get('sort') or []
+        if options.get('limit') and sort and sort[0].startswith('-'):
+            ret = self.context.entity_subscribers[self.entity_subscriber_name].query(*params, **options)
+            if len(ret) == options['limit']:
+                return unproject(ret, options.get('select'))
+
+        return page_query(self.context, self.history_query_call, params, options, self.primary_key_name)
+
     def get_one(self, name):
         self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
-        return copy.deepcopy(self.context.entity_subscribers[self.entity_subscriber_name].query(
+        ret = copy.deepcopy(self.context.entity_subscribers[self.entity_subscriber_name].query(
             (self.primary_key_name, '=', name), *self.extra_query_params,
             single=True
         ))
 
+        if ret is None and self.history_query_call:
+            return self.context.call_sync(
+                self.history_query_call,
+                [(self.primary_key_name, '=', name)] + self.extra_query_params,
+                {'single': True}
+            )
+
+        return ret
+
+    def complete_names(self, prefix):
+        if self.primary_key is None or not isinstance(self.primary_key.get, six.string_types):
+            return super(EntitySubscriberBasedLoadMixin, self).complete_names(prefix)
+
+        index = self.context.ml.completion_cache.index(
+            self.context,
+            self.entity_subscriber_name,
+            self.extra_query_params,
+            self.primary_key.get
+        )
+
+        if index is None:
+            return super(EntitySubscriberBasedLoadMixin, self).complete_names(prefix)
+
+        return index.search(prefix)
+
     def wait_one(self, name):
         self.context.entity_subscribers[self.entity_subscriber_name].enforce_update(
             (self.primary_key_name, '=', name), *self.extra_query_params
@@ -30,21 +30,83 @@ import importlib
 import sys
 import gettext
 import enum
+import datetime
 import time
-import contextlib
 import io
-import six
-import pydoc
+import shlex
+import shutil
+import subprocess
 import collections
+import contextlib
 
 from freenas.utils.permissions import get_unix_permissions, string_to_int
 from freenas.cli import config
 from freenas.utils import first_or_default
 from freenas.dispatcher import Password
-from threading import Lock, Thread
+from threading import Lock, Event, Condition, current_thread
+
 
+class OutputLock(object):
+    """
+    Serializes writes to the terminal. A command holds it while it runs,
+    so progress reported for it from other threads (task events, transfer
+    workers) is drawn on its behalf instead of waiting for it to finish.
+    """
+    def __init__(self):
+        self.cond = Condition()
+        self.owner = None
+        self.guest = False
+
+    def acquire(self, blocking=True, timeout=-1):
+        with self.cond:
+            if blocking:
+                acquired = self.cond.wait_for(self.__free, None if timeout < 0 else timeout)
+            else:
+                acquired = self.__free()
+
+            if acquired:
+                self.owner = current_thread()
+
+            return acquired
+
+    def release(self):
+        with self.cond:
+            # Let a draw done on behalf of the owner complete first
+            self.cond.wait_for(lambda: not self.guest)
+            self.owner = None
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def on_behalf_of(self, thread):
+        """
+        Holds the lock for writing on behalf of ``thread``: right away if
+        ``thread`` holds it, otherwise once nobody does.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: not self.guest and self.owner in (None, thread))
+            self.guest = True
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.guest = False
+                self.cond.notify_all()
 
-output_lock = Lock()
+    def __free(self):
+        return self.owner is None and not self.guest
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+output_lock = OutputLock()
+formatters = {}
+_active_formatter = None
+PROGRESS_BAR_WIDTH = 40
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
@@ -136,9 +198,12 @@ class Table(object):
                 'width': self.width
             }
 
-    def __init__(self, data, columns):
+    def __init__(self, data, columns, live=False):
         self.data = data
         self.columns = columns
+        # Rows of a live table arrive over time (e.g. followed logs);
+        # formatters write each of them out as soon as it's available
+        self.live = live
 
     def __len__(self):
         return len(self.data)
@@ -184,88 +249,130 @@ class Sequence(list):
         }
 
 
-class ProgressBar(object):
-    def __init__(self):
-        self.message = None
-        self.percentage = 0
-        self.draw_t = Thread(target=self.draw) if sys.stdout.isatty() else Thread(target=self.draw_static)
-        self.finished = False
-        sys.stdout.write('\n')
-        self.draw_t.daemon = True
-        self.draw_t.start()
-
-    def draw(self):
-        progress_width = 40
-        none_fill = ''.join('#' if i < 8 else '_' for i in range(progress_width))
-
-        def get_none_fill(f):
-            asc = True
-            while True:
-                yield f
-                if asc:
-                    f = f[-1] + f[:-1]
-                    if f[-1] == '#':
-                        asc = False
-                else:
-                    f = f[1:] + f[0]
-                    if f[0] == '#':
-                        asc = True
-
-        generator = get_none_fill(none_fill)
-        while True:
-            if self.percentage is None:
-                none_fill = next(generator)
-                fill = none_fill
-            else:
-                filled_width = int(self.percentage * progress_width)
-                fill = '#' * filled_width + '_' * (progress_width - filled_width)
-
-            sys.stdout.write('\033[2K\033[A\033[2K\r')
-            sys.stdout.write('Status: {}\n'.format(self.message))
-            sys.stdout.write('Total task progress: [{}] '.format(fill) +
-                             ('' if self.percentage is None else '{:.2%}'.format(self.percentage)))
-
-            sys.stdout.flush()
-            if self.finished:
-                break
-            time.sleep(0.5)
-
-    def draw_static(self):
-        old_message = ''
-
-        while True:
-            status = ''
-
-            if self.percentage is not None:
-                if self.message:
-                    status = 'Status {}. '.format(self.message)
-                status += 'Progress {:.2%}\n'.format(self.percentage)
-            elif old_message != self.message:
-                old_message = self.message
-                status = 'Status {}\n'.format(self.message)
-
-            if status:
-                sys.stdout.write(status)
-                sys.stdout.flush()
-
-            if self.finished:
-                break
-
-            time.sleep(1)
+class ProgressDisplay(object):
+    """
+    Shows progress of one or more tasks. Nothing is redrawn unless a task
+    reports a change; on a terminal every task gets its own bar with rate
+    and ETA, otherwise each change is written out as a single line.
+    """
+    class Task(object):
+        def __init__(self, label):
+            self.label = label
+            self.percentage = None
+            self.message = None
+            self.state = None
+            self.started_at = time.monotonic()
+            self.started_percentage = None
+
+        @property
+        def rate(self):
+            if self.percentage is None or self.started_percentage is None:
+                return None
+
+            elapsed = time.monotonic() - self.started_at
+            if elapsed <= 0 or self.percentage <= self.started_percentage:
+                return None
+
+            return (self.percentage - self.started_percentage) / elapsed
+
+        @property
+        def eta(self):
+            rate = self.rate
+            if not rate:
+                return None
+
+            return datetime.timedelta(seconds=int((100 - self.percentage) / rate))
+
+    def __init__(self, file=None):
+        self.file = file or sys.stdout
+        self.tty = self.file.isatty()
+        self.owner = current_thread()
+        self.lock = Lock()
+        self.done = Event()
+        self.tasks = collections.OrderedDict()
+        self.lines = 0
+
+    def add(self, tid, label):
+        with self.lock:
+            self.tasks[tid] = self.Task(label)
+
+    def update(self, tid, percentage=None, message=None, state=None):
+        with self.lock:
+            task = self.tasks.get(tid)
+            if not task or task.state:
+                return
+
+            percentage = None if percentage is None else float(percentage)
+            if percentage in (None, task.percentage) and message in (None, task.message) and not state:
+                return
+
+            if percentage is not None:
+                if task.started_percentage is None:
+                    task.started_at = time.monotonic()
+                    task.started_percentage = percentage
+
+                task.percentage = percentage
+
+            if message:
+                task.message = message
+
+            if state:
+                task.state = state
+                if state == 'FINISHED':
+                    task.percentage = 100.0
+
+            self.draw(task)
+            if all(t.state for t in self.tasks.values()):
+                self.done.set()
+
+    def wait(self):
+        self.done.wait()
 
-    def update(self, percentage=None, message=None):
-        self.percentage = None if percentage is None else float(percentage / 100.0)
+    def end(self):
+        with self.lock, output_lock.on_behalf_of(self.owner):
+            if self.tty and self.lines:
+                self.file.write('\n')
+                self.file.flush()
+                self.lines = 0
+
+    def render(self, task, width, bar=True):
+        line = '{0}:'.format(task.label)
+        if bar:
+            filled = int((task.percentage or 0) / 100 * PROGRESS_BAR_WIDTH)
+            line += ' [{0}{1}]'.format('#' * filled, '_' * (PROGRESS_BAR_WIDTH - filled))
+
+        if task.percentage is not None:
+            line += ' {0:.2f}%'.format(task.percentage)
+
+        if task.state:
+            line += ' {0}'.format(task.state.lower())
+        elif task.rate:
+            line += ' {0:.2f}%/s ETA {1}'.format(task.rate, task.eta)
+
+        if task.message:
+            line += ' {0}'.format(task.message)
+
+        return line[:width - 1]
+
+    def draw(self, changed):
+        with output_lock.on_behalf_of(self.owner):
+            self.__draw(changed)
+
+    def __draw(self, changed):
+        if not self.tty:
+            self.file.write(self.render(changed, sys.maxsize, bar=False) + '\n')
+            self.file.flush()
+            return
 
-        if message:
-            self.message = message
+        width = get_terminal_size()[1]
+        out = ['\r']
+        if self.lines > 1:
+            out.append('\033[{0}A'.format(self.lines - 1))
 
-    def finish(self):
-        self.percentage = 1
-
-    def end(self):
-        self.finished = True
-        self.draw_t.join()
-        sys.stdout.write('\n')
+        out.append('\n'.join('\033[2K' + self.render(t, width) for t in self.tasks.values()))
+        self.lines = len(self.tasks)
+        self.file.write(''.join(out))
+        self.file.flush()
 
 
 def get_terminal_size(fd=1):
@@ -368,80 +475,97 @@ def read_value(value, tv=ValueType.STRING):
 
 
 def format_value(value, vt=ValueType.STRING, fmt=None):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).format_value(value, vt)
+    return (get_formatter(fmt) if fmt else active_formatter()).format_value(value, vt)
 
 
 def output_value(value, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_value(value, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_value(value, **kwargs)
 
 
 def output_list(data, label=_("Items"), fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_list(data, label, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_list(data, label, **kwargs)
 
 
 def output_dict(data, key_label=_("Key"), value_label=_("Value"), fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_dict(data, key_label, value_label)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_dict(data, key_label, value_label, **kwargs)
 
 
 def output_table(table, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_table(table, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_table(table, **kwargs)
 
 
 def output_object(item, **kwargs):
     fmt = kwargs.pop('fmt', None)
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_object(item, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_object(item, **kwargs)
 
 
 def output_tree(tree, children, label, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_tree(tree, children, label, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_tree(tree, children, label, **kwargs)
+
+
+def register_formatter(name, formatter):
+    """
+    Makes ``formatter`` available as output format ``name``. Plugins call
+    this from their ``_init`` to add formats not shipped with the CLI.
+    """
+    global _active_formatter
+    formatters[name] = formatter
+    if config.instance:
+        variable = config.instance.variables.variables['output_format']
+        if variable.choices is not None and name not in variable.choices:
+            variable.choices.append(name)
+
+    _active_formatter = None
 
 
 def get_formatter(name):
-    module = importlib.import_module('freenas.cli.output.' + name)
-    return module._formatter()
+    formatter = formatters.get(name)
+    if formatter is None:
+        module = importlib.import_module('freenas.cli.output.' + name)
+        formatter = formatters.setdefault(name, module._formatter())
+
+    return formatter
+
+
+def set_active_formatter(name):
+    global _active_formatter
+    _active_formatter = get_formatter(name)
+
+
+def active_formatter():
+    global _active_formatter
+    if _active_formatter is None:
+        _active_formatter = get_formatter(config.instance.variables.get('output_format'))
+
+    return _active_formatter
 
 
 def output_msg(message, fmt=None, **kwargs):
-    fmt = fmt or config.instance.variables.get('output_format')
-    return get_formatter(fmt).output_msg(message, **kwargs)
+    return (get_formatter(fmt) if fmt else active_formatter()).output_msg(message, **kwargs)
 
 
 def output_is_ascii():
     return config.instance.variables.get('output_format') == 'ascii'
 
 
-# The following solution to implement `LESS(1)` style output is a combination
-# of snippets taken from the following stackoverflow answers:
-#   1. http://stackoverflow.com/questions/14197009/how-can-i-redirect-print-output-of-a-function-in-python#answer-14197079
-#   2. http://stackoverflow.com/questions/6728661/paging-output-from-python#answer-18234081
-@contextlib.contextmanager
-def stdout_redirect(where):
-    sys.stdout = where
-    try:
-        yield where
-    finally:
-        sys.stdout = sys.__stdout__
+def get_pager():
+    pager = os.environ.get('PAGER', 'less')
+    if not sys.stdout.isatty() or os.environ.get('TERM') in ('dumb', 'emacs'):
+        return None
 
+    if not shutil.which(shlex.split(pager)[0]):
+        return None
 
-class StringIO(io.StringIO):
-    """
-    Decode inputs so we can make it work in py2 and py3.
-    In py2 the print function automatically encode inputs.
-    """
-    def write(self, value, *args, **kwargs):
-        if six.PY2 and isinstance(value, str):
-            value = value.decode('utf8')
-        return super(StringIO, self).write(value, *args, **kwargs)
+    return pager
 
 
 def output_less(output_call_list):
+    """
+    Streams the output of ``output_call_list`` into $PAGER. Each callable
+    gets the pager pipe as its only argument and is called in order; a
+    broken pipe (the user quit the pager early) stops the remaining output.
+    Returns False if output was cut short, True otherwise.
+    """
     # First check if its either a list or a func (if not then raise TypeError)
     if hasattr(output_call_list, '__call__'):
         # It is a single func so just wrap it in a list and the below code
@@ -457,12 +581,42 @@ def output_less(output_call_list):
                         ' a list of functions. Instead the following type ' +
                         'was received: {0}'.format(type(output_call_list)))
 
-    with stdout_redirect(StringIO()) as new_stdout:
+    pager = get_pager()
+    if not pager:
+        for output_func_call in output_call_list:
+            output_func_call(sys.stdout)
+
+        return True
+
+    proc = subprocess.Popen(pager, shell=True, stdin=subprocess.PIPE)
+    pipe = io.TextIOWrapper(proc.stdin, encoding='utf-8', errors='backslashreplace')
+    completed = False
+
+    try:
         for output_func_call in output_call_list:
-            output_func_call(new_stdout)
+            output_func_call(pipe)
+
+        completed = True
+    except (BrokenPipeError, KeyboardInterrupt):
+        # The pager is gone or the user has interrupted the producer;
+        # in both cases whatever got through stays in the pager
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+        while True:
+            try:
+                proc.wait()
+                break
+            except KeyboardInterrupt:
+                # Like the pager itself, ignore ^C until it exits, otherwise
+                # the terminal is left in raw mode
+                pass
 
-    new_stdout.seek(0)
-    pydoc.pager(new_stdout.read())
+    return completed
 
 
 def format_output(object, **kwargs):
@@ -493,9 +647,15 @@ def refresh_prompt():
 
 
 def output_msg_locked(msg):
+    output_msgs_locked([msg])
+
+
+def output_msgs_locked(msgs):
     output_lock.acquire()
     config.instance.ml.blank_readline()
-    output_msg(msg)
+    for msg in msgs:
+        output_msg(msg)
+
     sys.stdout.flush()
     config.instance.ml.restore_readline()
     output_lock.release()
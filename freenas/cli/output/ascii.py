@@ -33,6 +33,8 @@ import time
 import gettext
 import natural.date
 import math
+import itertools
+import operator
 from dateutil.parser import parse
 from texttable import Texttable
 from freenas.cli import config
@@ -44,6 +46,10 @@ from freenas.utils.permissions import int_to_string
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+FORMAT_TABLE_SAMPLE_SIZE = 1000
+STREAM_BUFFER_SIZE = 64 * 1024
+STREAM_FLUSH_INTERVAL = 0.5
+
 
 def _is_ascii(s):
     return all(ord(char) < 128 for char in s)
@@ -158,27 +164,32 @@ class AsciiOutputFormatter(object):
         return columnizer.columnize(data)
 
     @staticmethod
-    def output_list(data, label, vt=ValueType.STRING, **kwargs):
+    def output_list(data, label, vt=ValueType.STRING, file=None, **kwargs):
+        file = file or sys.stdout
         ret = data
         for d in data:
             if isinstance(d, Table):
                 ret = [str(type(dd)) for dd in data]
-        sys.stdout.write(AsciiOutputFormatter.columnize([str(r) for r in ret]))
-        sys.stdout.flush()
+        file.write(AsciiOutputFormatter.columnize([str(r) for r in ret]))
+        file.flush()
 
     @staticmethod
-    def output_dict(data, key_label, value_label, value_vt=ValueType.STRING):
-        sys.stdout.write(AsciiOutputFormatter.columnize(
+    def output_dict(data, key_label, value_label, value_vt=ValueType.STRING, file=None, **kwargs):
+        file = file or sys.stdout
+        file.write(AsciiOutputFormatter.columnize(
             ['{0}={1}'.format(row[0], AsciiOutputFormatter.format_value(row[1], value_vt)) for row in list(data.items())]
         ))
-        sys.stdout.flush()
+        file.flush()
 
     @staticmethod
-    def output_table(tab, file=sys.stdout, **kwargs):
-        AsciiOutputFormatter._print_stream_table(tab, file, end=('\n' if kwargs.get('newline', True) else ' '))
+    def output_table(tab, file=None, **kwargs):
+        AsciiOutputFormatter._print_stream_table(
+            tab, file or sys.stdout,
+            end=('\n' if kwargs.get('newline', True) else ' ')
+        )
 
     @staticmethod
-    def output_object(obj, file=sys.stdout, **kwargs):
+    def output_object(obj, file=None, **kwargs):
         values = []
         editable_column = False
         for item in obj:
@@ -199,15 +210,13 @@ class AsciiOutputFormatter(object):
         if editable_column: 
             cols.append(Table.Column("Settable", 'editable'))
 
-        table = AsciiOutputFormatter.format_table(Table(values, cols))
-        try:
-            six.print_(table.draw(), file=file, end=('\n' if kwargs.get('newline', True) else ' '))
-        except UnicodeEncodeError:
-            table = AsciiOutputFormatter.format_table(Table(values, cols), conv2ascii=True)
-            six.print_(table.draw(), file=file, end=('\n' if kwargs.get('newline', True) else ' '))
+        AsciiOutputFormatter._print_table(
+            Table(values, cols), file or sys.stdout,
+            end=('\n' if kwargs.get('newline', True) else ' ')
+        )
 
     @staticmethod
-    def output_tree(tree, children, label, label_vt=ValueType.STRING, file=sys.stdout):
+    def output_tree(tree, children, label, label_vt=ValueType.STRING, file=None, **kwargs):
         def branch(obj, indent):
             for idx, i in enumerate(obj):
                 subtree = resolve_cell(i, children)
@@ -219,48 +228,71 @@ class AsciiOutputFormatter(object):
         branch(tree, 0)
 
     @staticmethod
-    def output_msg(message, **kwargs):
+    def output_msg(message, file=None, **kwargs):
         six.print_(
             format_literal(message, **kwargs),
             end=('\n' if kwargs.get('newline', True) else ' '),
-            file=kwargs.pop('file', sys.stdout)
+            file=file or sys.stdout
         )
 
     @staticmethod
     def _print_stream_table(tab, file, end):
-        def _print_header(columns, file, end, printer=None):
-            printer.print_header(columns, file, end) if printer else six.print_([col.label for col in columns], file=file, end=end)
+        printer = AsciiStreamTablePrinter()
+        try:
+            printer.print_header(tab.columns, file, end)
+            for row in tab.data:
+                printer.print_row(row, file, end)
+                if tab.live:
+                    printer.flush(file)
+        finally:
+            printer.flush(file)
 
-        def _print_rows(rows, columns, file, end, printer=None):
-            for row in rows:
-                printer.print_row(row, file, end) if printer else six.print_([row[col.accessor] for col in columns], file=file, end=end)
+    @staticmethod
+    def _print_table(tab, file, end):
+        # Widths are computed from the first FORMAT_TABLE_SAMPLE_SIZE rows only;
+        # the remaining rows are drawn in chunks of the same size using those
+        # widths, so huge inputs never have to be formatted all at once.
+        data = iter(tab.data)
+        rows = AsciiOutputFormatter.format_rows(tab.columns, itertools.islice(data, FORMAT_TABLE_SAMPLE_SIZE))
+        widths = AsciiOutputFormatter.compute_widths(tab.columns, rows)
+        header = True
+
+        while rows or header:
+            last = len(rows) < FORMAT_TABLE_SAMPLE_SIZE
+            table = AsciiOutputFormatter.format_table(tab, rows=rows, widths=widths, header=header)
+            try:
+                six.print_(table.draw(), file=file, end=end if last else '\n')
+            except UnicodeEncodeError:
+                table = AsciiOutputFormatter.format_table(tab, rows=rows, widths=widths, header=header, conv2ascii=True)
+                six.print_(table.draw(), file=file, end=end if last else '\n')
 
-        printer = AsciiStreamTablePrinter()
-        _print_header(tab.columns, file, end, printer=printer)
-        _print_rows(tab.data, tab.columns, file, end, printer=printer)
+            if last:
+                break
 
-    def format_table(tab, conv2ascii=False):
-        def _try_conv2ascii(s):
-            return ascii(s) if not _is_ascii(s) and isinstance(s, str) else s
+            rows = AsciiOutputFormatter.format_rows(tab.columns, itertools.islice(data, FORMAT_TABLE_SAMPLE_SIZE))
+            header = False
 
-        max_width = get_terminal_size()[1]
-        table = Texttable(max_width=max_width)
-        table.set_deco(0)
-        table.header([i.label for i in tab.columns])
+    @staticmethod
+    def format_rows(columns, data):
+        accessors = [(col.accessor, col.vt) for col in columns]
+        return [
+            [str(AsciiOutputFormatter.format_value(resolve_cell(row, acc), vt)) for acc, vt in accessors]
+            for row in data
+        ]
 
+    @staticmethod
+    def compute_widths(columns, rows):
+        max_width = get_terminal_size()[1]
         widths = []
         ideal_widths = []
-        number_columns = len(tab.columns)
+        number_columns = len(columns)
         remaining_space = max_width
         # set maximum column width based on the amount of terminal space minus the 3 pixel borders
         max_col_width = (remaining_space - number_columns * 3) / number_columns
         for i in range(0, number_columns):
-            current_width = len(tab.columns[i].label)
-            tab_cols_acc = tab.columns[i].accessor
-            if len(tab.data) > 0:
-                max_row_width = max(
-                        [len(str(resolve_cell(row, tab_cols_acc))) for row in tab.data ]
-                        )
+            current_width = len(columns[i].label)
+            if len(rows) > 0:
+                max_row_width = max(len(row[i]) for row in rows)
                 ideal_widths.insert(i, max_row_width)
                 current_width = max_row_width if max_row_width > current_width else current_width
             if current_width < max_col_width:
@@ -285,15 +317,30 @@ class AsciiOutputFormatter(object):
                     elif needed_space > remaining_space:
                         widths[i] = widths[i] + remaining_space
                         remaining_space = 0
-        table.set_cols_width(widths)
 
+        return widths
+
+    def format_table(tab, conv2ascii=False, rows=None, widths=None, header=True):
+        def _try_conv2ascii(s):
+            return ascii(s) if not _is_ascii(s) and isinstance(s, str) else s
+
+        if rows is None:
+            rows = AsciiOutputFormatter.format_rows(tab.columns, tab.data)
+
+        if widths is None:
+            widths = AsciiOutputFormatter.compute_widths(tab.columns, rows)
+
+        table = Texttable(max_width=get_terminal_size()[1])
+        table.set_deco(0)
+        if header:
+            table.header([i.label for i in tab.columns])
+
+        table.set_cols_width(widths)
         table.set_cols_dtype(['t'] * len(tab.columns))
         if conv2ascii:
-            table.add_rows([[AsciiOutputFormatter.format_value(
-                _try_conv2ascii(resolve_cell(row, i.accessor)), i.vt) for i in tab.columns] for row in tab.data], False)
+            table.add_rows([[_try_conv2ascii(i) for i in row] for row in rows], False)
         else:
-            table.add_rows([[AsciiOutputFormatter.format_value(
-                resolve_cell(row, i.accessor), i.vt) for i in tab.columns] for row in tab.data], False)
+            table.add_rows(rows, False)
         return table
 
 
@@ -302,43 +349,60 @@ def _formatter():
 
 
 class AsciiStreamTablePrinter(object):
+    """
+    Prints table rows as they come. Column layout is computed once from the
+    header; rendered lines are collected in a buffer which is written out
+    when it grows past STREAM_BUFFER_SIZE characters or when
+    STREAM_FLUSH_INTERVAL seconds have passed since the last write.
+    """
     def __init__(self):
         self.display_size = get_terminal_size()[1]
         self.usable_display_width = self.display_size
-        self._cleanup_all()
         self.visible_separators = False
-
-    def _cleanup_all(self):
         self.cols_widths = []
-        self._cleanup_lines()
-
-    def _cleanup_lines(self):
-        self.ordered_line_elements = []
-        self.ordered_lines_elements = []
-        self.ordered_lines = []
+        self.getters = []
+        self.value_types = []
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.check_encoding = None
 
     def print_header(self, columns, file, end):
         self._compute_cols_widths(columns)
-        self._load_accessors(columns)
-        self._load_value_types(columns)
-        self._load_header_elements(columns)
-        self._trim_elements()
-        self._render_lines()
-        self._add_vertical_separator_line()
-        self._print_lines(file, end)
+        self.getters = [acc if callable(acc) else operator.itemgetter(acc) for acc in (col.accessor for col in columns)]
+        self.value_types = [col.vt for col in columns]
+        self.separator = '|' if self.visible_separators else ' '
+        encoding = (getattr(file, 'encoding', None) or '').lower().replace('-', '')
+        self.check_encoding = None if encoding in ('', 'utf8') else encoding
+
+        self._write(self._render([col.label for col in columns]), file, end)
+        self._write([('=' if self.visible_separators else ' ') * self.usable_display_width], file, end)
 
     def print_row(self, row, file, end):
-        self._load_row_elements(row)
-        self._trim_elements()
-        self._render_lines()
-        try:
-            self._print_lines(file, end)
-        except UnicodeEncodeError:
-            self._cleanup_lines()
-            self._load_row_elements(row, conv2ascii=True)
-            self._trim_elements()
-            self._render_lines()
-            self._print_lines(file, end)
+        lines = self._render(self._format_row(row))
+        if self.check_encoding:
+            try:
+                end.join(lines).encode(self.check_encoding)
+            except UnicodeEncodeError:
+                lines = self._render(self._format_row(row, conv2ascii=True))
+
+        self._write(lines, file, end)
+
+    def flush(self, file):
+        if self.buffer:
+            file.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+        file.flush()
+        self.last_flush = time.monotonic()
+
+    def _write(self, lines, file, end):
+        text = end.join(lines) + end
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= STREAM_BUFFER_SIZE or time.monotonic() - self.last_flush >= STREAM_FLUSH_INTERVAL:
+            self.flush(file)
 
     def _compute_cols_widths(self, columns):
         def extend_cols_widths(additional_space):
@@ -365,30 +429,17 @@ class AsciiStreamTablePrinter(object):
         cols_widths_fracts_ints = [math.modf((self.display_size-self.borders_space)*(col.width/100))
                                   for col in columns]
         space_from_fracts = int(sum([col[0] for col in cols_widths_fracts_ints]))
-        self.cols_widths = [int(col[1]) for col in cols_widths_fracts_ints]
+        self.cols_widths = [max(int(col[1]), 1) for col in cols_widths_fracts_ints]
         extend_cols_widths(space_from_fracts)
         self.usable_display_width = sum(self.cols_widths) + self.borders_space
 
-    def _load_accessors(self, columns):
-        self.accessors = [col.accessor for col in columns]
-
-    def _load_value_types(self, columns):
-        self.value_types = [col.vt for col in columns]
-
-    def _load_header_elements(self, columns):
-        self.ordered_line_elements = [col.label for col in columns]
-        self.ordered_lines_elements = [self.ordered_line_elements]
-
-    def _load_row_elements(self, row, conv2ascii=False):
-
+    def _format_row(self, row, conv2ascii=False):
         def convert_nested_dict_to_string(dict):
             return ", ".join([":".join([k, v]) for k, v in dict.items()])
 
-        for i, acc in enumerate(self.accessors):
-            if callable(acc):
-                elem = acc(row)
-            else:
-                elem = row[acc]
+        elements = []
+        for getter, vt in zip(self.getters, self.value_types):
+            elem = getter(row)
 
             if isinstance(elem, dict):
                 elem = convert_nested_dict_to_string(elem)
@@ -396,94 +447,52 @@ class AsciiStreamTablePrinter(object):
             if conv2ascii and isinstance(elem, str):
                 elem = ascii(elem) if not _is_ascii(elem) else elem
 
-            self.ordered_line_elements.append(AsciiOutputFormatter.format_value(elem, self.value_types[i]))
-
-        self.ordered_lines_elements = [self.ordered_line_elements]
+            elements.append(str(AsciiOutputFormatter.format_value(elem, vt)))
 
-    def _trim_elements(self):
-        def split_line_element(line_index, elem_index, element):
-            def has_2ormore_words(element):
-                return len(element.split()) > 1
+        return elements
 
-            def try_pretty_split(element, index):
-                return len(element.split()[0]) < self.cols_widths[index]
-
-            def do_pretty_split(curr_line, next_line, elem_index):
-                all_words = curr_line[elem_index].split()
-                words_to_curr_line = all_words.pop(0)
-                words_to_next_line = ""
-                for i, word in enumerate(all_words):
-                    if len(words_to_curr_line + " " + word) < self.cols_widths[elem_index]:
-                        words_to_curr_line += " " + word
+    @staticmethod
+    def _wrap(element, width):
+        # Like the table printer always did, cells as wide as their column
+        # are wrapped too, and the remainder is kept even when empty
+        if len(element) < width:
+            return [element]
+
+        parts = []
+        while len(element) >= width:
+            words = element.split()
+            if len(words) > 1 and len(words[0]) < width:
+                # Pretty split: as many whole words as fit go to this line
+                line = words[0]
+                rest = len(words)
+                for i in range(1, len(words)):
+                    if len(line) + 1 + len(words[i]) < width:
+                        line += ' ' + words[i]
                     else:
-                        words_to_next_line += " ".join(all_words[i:])
+                        rest = i
                         break
 
-                curr_line[elem_index] = words_to_curr_line
-                next_line[elem_index] = words_to_next_line
-                return curr_line, next_line
-
-            def do_ugly_split(curr_line, next_line, elem_index, element):
-                splitted = [element[0: self.cols_widths[elem_index]], element[self.cols_widths[elem_index]:]]
-                curr_line[elem_index] = splitted[0]
-                next_line[elem_index] = splitted[1]
-                return curr_line, next_line
-
-            curr_line = self.ordered_lines_elements[line_index]
-            try:
-                next_line = self.ordered_lines_elements[line_index+1]
-            except IndexError:
-                next_line = ["" for _ in range(0, len(curr_line))]
-            if has_2ormore_words(element) and try_pretty_split(element, elem_index):
-                return do_pretty_split(curr_line, next_line, elem_index)
-            else:
-                return do_ugly_split(curr_line, next_line, elem_index, element)
-
-        for line_index, ordered_line_elements in enumerate(self.ordered_lines_elements):
-            for elem_index, elem in enumerate(ordered_line_elements):
-                if len(elem) >= self.cols_widths[elem_index]:
-                    curr_line, next_line = split_line_element(line_index, elem_index, elem)
-                    self.ordered_lines_elements[line_index] = curr_line
-                    try:
-                        self.ordered_lines_elements[line_index+1] = next_line
-                    except IndexError:
-                        self.ordered_lines_elements.append(next_line)
-
-    def _render_lines(self):
-        def render_line(ordered_line_elements):
-            ordered_line_elements_with_spaces = [
-                surround_with_spaces(e, i, left_aligned=True) for i, e in enumerate(ordered_line_elements)
-                ]
-            line = " " if not self.visible_separators else "|"
-            for e in ordered_line_elements_with_spaces:
-                line += e+" " if not self.visible_separators else e+"|"
-            self.ordered_lines.append(line)
-
-        def surround_with_spaces(element, index, left_aligned=False, right_aligned=False):
-            num_of_spaces = self.cols_widths[index] - len(element)
-            if num_of_spaces < 1:
-                return element
-            left_spaces = right_spaces = " " * int(num_of_spaces / 2)
-            odd_spaces = " " * int(num_of_spaces % 2)
-            if left_aligned:
-                return element + left_spaces + right_spaces + odd_spaces
-            elif right_aligned:
-                return left_spaces + right_spaces + odd_spaces + element
+                parts.append(line)
+                element = ' '.join(words[rest:])
             else:
-                return left_spaces + element + right_spaces + odd_spaces
-
-        for ordered_line_elements in self.ordered_lines_elements:
-            render_line(ordered_line_elements)
-
-    def _add_vertical_separator_line(self):
-        def get_vertical_separator():
-            return " " * self.usable_display_width if not self.visible_separators else "=" * self.usable_display_width
-        self.ordered_lines.append(get_vertical_separator())
-
-    def _print_lines(self, file, end):
-        for line in self.ordered_lines:
-            six.print_(line, file=file, end=end)
-        self._cleanup_lines()
+                parts.append(element[:width])
+                element = element[width:]
+
+        parts.append(element)
+        return parts
+
+    def _render(self, elements):
+        sep = self.separator
+        widths = self.cols_widths
+        if all(len(e) < w for e, w in zip(elements, widths)):
+            return [sep + sep.join(e.ljust(w) for e, w in zip(elements, widths)) + sep]
+
+        wrapped = [self._wrap(e, w) for e, w in zip(elements, widths)]
+        height = max(len(i) for i in wrapped)
+        return [
+            sep + sep.join((cell[n] if n < len(cell) else '').ljust(w) for cell, w in zip(wrapped, widths)) + sep
+            for n in range(height)
+        ]
 
 
 class Columnizer(object):
@@ -0,0 +1,134 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import csv
+import sys
+import datetime
+from freenas.dispatcher.jsonenc import dumps
+from freenas.cli.output import ValueType, resolve_cell
+
+
+class CsvOutputFormatter(object):
+    """
+    Writes tables as comma separated values, one row at a time. Values are
+    emitted raw (sizes in bytes, times as timestamps) rather than humanized,
+    so the output can be fed straight into spreadsheets or other tools.
+    """
+    dialect = 'excel'
+
+    @staticmethod
+    def format_value(value, vt):
+        if value is None:
+            return ''
+
+        if vt == ValueType.BOOLEAN:
+            return 'true' if value else 'false'
+
+        if vt in (ValueType.SET, ValueType.ARRAY):
+            return ','.join(str(i) for i in value)
+
+        if vt == ValueType.DICT:
+            return dumps(value)
+
+        if vt == ValueType.HEXNUMBER:
+            return hex(value)
+
+        if vt == ValueType.OCTNUMBER:
+            return oct(value)
+
+        if vt == ValueType.PERMISSIONS:
+            return oct(value['value'])
+
+        if vt == ValueType.PASSWORD:
+            return '*****'
+
+        if vt in (ValueType.TIME, ValueType.DATE) and isinstance(value, datetime.datetime):
+            return value.isoformat()
+
+        if isinstance(value, (dict, list)):
+            return dumps(value)
+
+        return str(value)
+
+    @classmethod
+    def writer(cls, file):
+        return csv.writer(file or sys.stdout, dialect=cls.dialect, lineterminator='\n')
+
+    @classmethod
+    def output_list(cls, data, label, file=None, **kwargs):
+        writer = cls.writer(file)
+        writer.writerow([label])
+        for i in data:
+            writer.writerow([cls.format_value(i, ValueType.STRING)])
+
+    @classmethod
+    def output_dict(cls, data, key_label, value_label, file=None, **kwargs):
+        writer = cls.writer(file)
+        writer.writerow([key_label, value_label])
+        for k, v in data.items():
+            writer.writerow([k, cls.format_value(v, ValueType.STRING)])
+
+    @classmethod
+    def output_table(cls, table, file=None, **kwargs):
+        writer = cls.writer(file)
+        columns = table.columns
+        writer.writerow([col.label for col in columns])
+        for row in table.data:
+            writer.writerow([cls.format_value(resolve_cell(row, col.accessor), col.vt) for col in columns])
+            if table.live:
+                (file or sys.stdout).flush()
+
+    @classmethod
+    def output_object(cls, obj, file=None, **kwargs):
+        writer = cls.writer(file)
+        writer.writerow(['name', 'value'])
+        for item in obj:
+            writer.writerow([item.name, cls.format_value(item.value, item.vt)])
+
+    @classmethod
+    def output_tree(cls, tree, children, label, file=None, **kwargs):
+        def branch(obj, path):
+            for i in obj:
+                name = path + [str(resolve_cell(i, label))]
+                writer.writerow(['/'.join(name)])
+                subtree = resolve_cell(i, children)
+                if subtree:
+                    branch(subtree, name)
+
+        writer = cls.writer(file)
+        branch(tree, [])
+
+    @classmethod
+    def output_msg(cls, message, file=None, **kwargs):
+        if isinstance(message, (list, dict)):
+            message = dumps(message)
+
+        print(message, file=file or sys.stdout)
+
+
+def _formatter():
+    return CsvOutputFormatter
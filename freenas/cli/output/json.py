@@ -25,7 +25,9 @@
 #
 #####################################################################
 
+import sys
 import six
+import textwrap
 from freenas.dispatcher.jsonenc import dumps
 from freenas.cli.output import ValueType, resolve_cell
 
@@ -63,38 +65,48 @@ class JsonOutputFormatter(object):
         return dumps(value)
 
     @staticmethod
-    def output_list(data, label):
-        six.print_(dumps(list(data), indent=4))
+    def format_row(row, columns):
+        return {col.label: JsonOutputFormatter.format_value(resolve_cell(row, col.accessor), col.vt) for col in columns}
 
     @staticmethod
-    def output_dict(data, key_label, value_label):
-        six.print_(dumps(dict(data), indent=4))
+    def output_list(data, label, file=None, **kwargs):
+        six.print_(dumps(list(data), indent=4), file=file)
 
     @staticmethod
-    def output_table(table):
-        output = []
+    def output_dict(data, key_label, value_label, file=None, **kwargs):
+        six.print_(dumps(dict(data), indent=4), file=file)
+
+    @staticmethod
+    def output_table(table, file=None, **kwargs):
+        # Rows are encoded and written one by one, so that neither the full
+        # list of rows nor the whole JSON document is ever held in memory.
+        file = file or sys.stdout
+        empty = True
+        file.write('[')
         for row in table.data:
-            rowdata = {}
-            for col in table.columns:
-                rowdata[col.label] = JsonOutputFormatter.format_value(resolve_cell(row, col.accessor), col.vt)
-            output.append(rowdata)
+            file.write('\n' if empty else ',\n')
+            file.write(textwrap.indent(dumps(JsonOutputFormatter.format_row(row, table.columns), indent=4), '    '))
+            empty = False
+            if table.live:
+                file.flush()
 
-        six.print_(dumps(output, indent=4))
+        file.write(']\n' if empty else '\n]\n')
+        file.flush()
 
     @staticmethod
-    def output_tree(data, children, label):
-        six.print_(dumps(list(data), indent=4))
+    def output_tree(data, children, label, file=None, **kwargs):
+        six.print_(dumps(list(data), indent=4), file=file)
 
     @staticmethod
-    def output_msg(data, **kwargs):
-        six.print_(dumps(data, indent=4))
+    def output_msg(data, file=None, **kwargs):
+        six.print_(dumps(data, indent=4), file=file)
 
     @staticmethod
-    def output_object(obj):
+    def output_object(obj, file=None, **kwargs):
         output = {}
         for item in obj:
             output[item.name] = JsonOutputFormatter.format_value(item.value, item.vt)
-        six.print_(dumps(output, indent=4))
+        six.print_(dumps(output, indent=4), file=file)
 
 
 def _formatter():
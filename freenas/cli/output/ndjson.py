@@ -0,0 +1,81 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import sys
+import six
+from freenas.dispatcher.jsonenc import dumps
+from freenas.cli.output.json import JsonOutputFormatter
+
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+class NdjsonOutputFormatter(JsonOutputFormatter):
+    """
+    Newline delimited JSON: every table row, list item or object is
+    written as a single compact JSON document on its own line.
+    """
+    @staticmethod
+    def output_list(data, label, file=None, **kwargs):
+        file = file or sys.stdout
+        for i in data:
+            file.write(dumps(i, separators=COMPACT_SEPARATORS) + '\n')
+
+        file.flush()
+
+    @staticmethod
+    def output_dict(data, key_label, value_label, file=None, **kwargs):
+        six.print_(dumps(dict(data), separators=COMPACT_SEPARATORS), file=file)
+
+    @staticmethod
+    def output_table(table, file=None, **kwargs):
+        file = file or sys.stdout
+        for row in table.data:
+            file.write(dumps(NdjsonOutputFormatter.format_row(row, table.columns), separators=COMPACT_SEPARATORS) + '\n')
+            if table.live:
+                file.flush()
+
+        file.flush()
+
+    @staticmethod
+    def output_tree(data, children, label, file=None, **kwargs):
+        NdjsonOutputFormatter.output_list(data, label, file=file)
+
+    @staticmethod
+    def output_msg(data, file=None, **kwargs):
+        six.print_(dumps(data, separators=COMPACT_SEPARATORS), file=file)
+
+    @staticmethod
+    def output_object(obj, file=None, **kwargs):
+        output = {}
+        for item in obj:
+            output[item.name] = NdjsonOutputFormatter.format_value(item.value, item.vt)
+        six.print_(dumps(output, separators=COMPACT_SEPARATORS), file=file)
+
+
+def _formatter():
+    return NdjsonOutputFormatter
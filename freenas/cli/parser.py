@@ -25,8 +25,13 @@
 #
 #####################################################################
 
+import os
 import six
 import re
+import json
+import hashlib
+import tempfile
+import contextlib
 import ply.lex as lex
 import ply.yacc as yacc
 from freenas.cli import config
@@ -45,6 +50,12 @@ LITERAL_TYPES = {
 LITERAL_TYPES_REVERSED = {v: k for k, v in LITERAL_TYPES.items()}
 logger = logging.getLogger('freenascli.parser')
 
+AST_CACHE_DIR = os.path.expanduser('~/.cli_cache')
+AST_CACHE_SUFFIX = 'c'
+AST_CACHE_FORMAT = 2
+AST_CACHE_MAX_ENTRIES = 256
+AST_NODES = {}
+
 
 def ASTObject(name, *args):
     def string(self):
@@ -109,7 +120,8 @@ def ASTObject(name, *args):
     dct['__repr__'] = string
     dct['args_list'] = args
     dct['to_json'] = to_json
-    return type(name, (), dct)
+    AST_NODES[name] = type(name, (), dct)
+    return AST_NODES[name]
 
 
 Comment = ASTObject('Comment', 'text')
@@ -1094,7 +1106,244 @@ lexer = lex.lex(reflags=re.UNICODE)
 parser = yacc.yacc(debug=False, optimize=True)
 
 
+# Fast path for plain command lines such as "volume tank dataset show" or
+# "account user create foo uid=1000 groups=a,b". Lines consisting only of
+# atoms, integers, strings, "?", "..", commas, pipes and binary parameters
+# are tokenized and parsed by hand into the very same AST the grammar
+# would build, positions included. Anything else falls back to PLY.
+FAST_ATOM_RE = re.compile(r'[A-Za-z_/\-\+\*][A-Za-z0-9_\./@\+\*\-]*')
+FAST_NUMBER_RE = re.compile(r'\d+')
+FAST_STRING_RE = re.compile(t_STRING.__doc__)
+FAST_OPERATORS = ('=+', '=-', '==', '!=', '>=', '<=', '~=', '=', '>', '<')
+FAST_ATOM_TERMINATORS = ' \t,=!<>~|'
+FAST_NUMBER_TERMINATORS = ' \t,|'
+
+
+class FastPathMiss(Exception):
+    pass
+
+
+def fast_tokenize(s):
+    pos = 0
+    length = len(s)
+    while pos < length:
+        c = s[pos]
+        if c in ' \t':
+            pos += 1
+            continue
+
+        if c == '"':
+            if s.startswith('"""', pos):
+                raise FastPathMiss()
+
+            m = FAST_STRING_RE.match(s, pos)
+            if not m:
+                raise FastPathMiss()
+
+            yield 'STRING', m.group()[1:-1], pos
+            pos = m.end()
+            continue
+
+        if c.isdigit():
+            m = FAST_NUMBER_RE.match(s, pos)
+            end = m.end()
+            if end < length and s[end] not in FAST_NUMBER_TERMINATORS:
+                raise FastPathMiss()
+
+            yield 'NUMBER', int(m.group()), pos
+            pos = end
+            continue
+
+        if c == '.':
+            if not s.startswith('..', pos) or (pos + 2 < length and s[pos + 2] not in ' \t|'):
+                raise FastPathMiss()
+
+            yield 'UP', '..', pos
+            pos += 2
+            continue
+
+        if c == '?':
+            yield 'LIST', '?', pos
+            pos += 1
+            continue
+
+        if c == ',':
+            yield 'COMMA', ',', pos
+            pos += 1
+            continue
+
+        if c == '|':
+            yield 'PIPE', '|', pos
+            pos += 1
+            continue
+
+        if c in '=!<>~':
+            if s.startswith('>>', pos):
+                raise FastPathMiss()
+
+            op = first_operator(s, pos)
+            if not op:
+                raise FastPathMiss()
+
+            yield 'OP', op, pos
+            pos += len(op)
+            continue
+
+        m = FAST_ATOM_RE.match(s, pos)
+        if not m:
+            raise FastPathMiss()
+
+        end = m.end()
+        value = m.group()
+        if (end < length and s[end] not in FAST_ATOM_TERMINATORS) or value in reserved or value == 'null':
+            raise FastPathMiss()
+
+        yield 'ATOM', value, pos
+        pos = end
+
+
+def first_operator(s, pos):
+    for op in FAST_OPERATORS:
+        if s.startswith(op, pos):
+            return op
+
+    return None
+
+
+def fast_parse(s, filename):
+    """
+    Returns AST of a plain command line, or None when `s` uses anything
+    beyond the subset handled here and has to go through the full parser.
+    """
+    if '\n' in s or '\\' in s:
+        return None
+
+    try:
+        tokens = list(fast_tokenize(s))
+        if not tokens:
+            return None
+
+        command, idx = fast_parse_command(tokens, 0, filename)
+    except FastPathMiss:
+        return None
+
+    if idx != len(tokens):
+        return None
+
+    return [command]
+
+
+def fast_node(cls, filename, start, end, *values):
+    node = cls(*values)
+    node.file = filename
+    node.line = 1
+    node.column = start
+    node.column_end = end
+    return node
+
+
+def fast_parse_command(tokens, idx, filename):
+    ttype, value, pos = tokens[idx]
+    next_type = tokens[idx + 1][0] if idx + 1 < len(tokens) else None
+
+    if ttype == 'ATOM':
+        if next_type == 'OP':
+            raise FastPathMiss()
+
+        item = fast_node(Symbol, filename, pos, pos, value)
+    elif ttype in ('NUMBER', 'LIST'):
+        item = fast_node(Symbol, filename, pos, pos, value)
+    elif ttype == 'UP':
+        item = value
+    elif ttype == 'STRING':
+        item = Literal(value, str)
+    else:
+        raise FastPathMiss()
+
+    start = end = pos
+    args = [item]
+    idx += 1
+
+    while idx < len(tokens) and tokens[idx][0] != 'PIPE':
+        param, end, idx = fast_parse_parameter(tokens, idx, filename)
+        args.append(param)
+
+    if idx < len(tokens):
+        if idx + 1 == len(tokens):
+            raise FastPathMiss()
+
+        right, idx = fast_parse_command(tokens, idx + 1, filename)
+        end = right.column_end
+        left = fast_node(CommandCall, filename, start, end, args)
+        return fast_node(PipeExpr, filename, start, end, left, right), idx
+
+    return fast_node(CommandCall, filename, start, end, args), idx
+
+
+def fast_parse_parameter(tokens, idx, filename):
+    ttype, value, pos = tokens[idx]
+    if ttype == 'ATOM' and idx + 1 < len(tokens) and tokens[idx + 1][0] == 'OP':
+        op = tokens[idx + 1][1]
+        if idx + 2 == len(tokens):
+            raise FastPathMiss()
+
+        right, end, idx = fast_parse_set(tokens, idx + 2, filename)
+        return fast_node(BinaryParameter, filename, pos, end, value, op, right), end, idx
+
+    return fast_parse_set(tokens, idx, filename)
+
+
+def fast_parse_set(tokens, idx, filename):
+    items = []
+    while True:
+        item, end, idx = fast_parse_unary(tokens, idx, filename)
+        items.append(item)
+        if idx < len(tokens) and tokens[idx][0] == 'COMMA':
+            if idx + 1 == len(tokens):
+                raise FastPathMiss()
+
+            idx += 1
+            continue
+
+        break
+
+    return (items[0] if len(items) == 1 else items), end, idx
+
+
+def fast_parse_unary(tokens, idx, filename):
+    ttype, value, pos = tokens[idx]
+    next_type = tokens[idx + 1][0] if idx + 1 < len(tokens) else None
+
+    if ttype == 'ATOM':
+        if next_type == 'OP':
+            raise FastPathMiss()
+
+        return fast_node(Symbol, filename, pos, pos, value), pos, idx + 1
+
+    if ttype == 'NUMBER':
+        return fast_node(Literal, filename, pos, pos, value, int), pos, idx + 1
+
+    if ttype == 'STRING':
+        return fast_node(Literal, filename, pos, pos, value, str), pos, idx + 1
+
+    if ttype == 'LIST':
+        return Symbol(value), pos, idx + 1
+
+    if ttype == 'UP':
+        return value, pos, idx + 1
+
+    raise FastPathMiss()
+
+
 def parse(s, filename, recover_errors=False):
+    ast = fast_parse(s, filename)
+    if ast is not None:
+        return ast
+
+    return parse_slow(s, filename, recover_errors)
+
+
+def parse_slow(s, filename, recover_errors=False):
     lexer.lineno = 1
     lexer.parens = 0
     lexer.breaknl = False
@@ -1106,6 +1355,205 @@ def parse(s, filename, recover_errors=False):
     return parser.parse(s, lexer=lexer, tracking=True)
 
 
+def _parser_signature():
+    # Changes to the grammar or to AST node layout live in this file,
+    # so its digest invalidates every cached AST built by an older CLI.
+    h = hashlib.sha256(str(AST_CACHE_FORMAT).encode('ascii'))
+    with contextlib.suppress(OSError, NameError):
+        with open(__file__, 'rb') as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+PARSER_SIGNATURE = _parser_signature()
+
+
+AST_POSITION_ATTRS = ('file', 'line', 'column', 'column_end')
+
+
+def encode_ast(value):
+    """
+    Turns an AST into plain JSON data for the cache. Unlike dump_ast, it
+    keeps node positions and dict literals keyed by expressions.
+    """
+    if AST_NODES.get(type(value).__name__) is type(value):
+        ret = {'node': type(value).__name__, 'args': [encode_ast(getattr(value, i)) for i in value.args_list]}
+        if 'line' in value.__dict__:
+            ret['pos'] = [getattr(value, i, None) for i in AST_POSITION_ATTRS]
+
+        return ret
+
+    if isinstance(value, type):
+        return {'type': LITERAL_TYPES_REVERSED[value]}
+
+    if isinstance(value, list):
+        return [encode_ast(i) for i in value]
+
+    if isinstance(value, tuple):
+        return {'tuple': [encode_ast(i) for i in value]}
+
+    if isinstance(value, dict):
+        return {'dict': [[encode_ast(k), encode_ast(v)] for k, v in value.items()]}
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    raise TypeError('Cannot encode {0} in an AST cache'.format(type(value).__name__))
+
+
+def decode_ast(value, file=None):
+    """
+    Inverse of encode_ast. Only AST node classes and literal types can be
+    instantiated, whatever the data says. Positions are attributed to
+    `file` if given, as the same cache entry serves every script with the
+    same contents.
+    """
+    if isinstance(value, list):
+        return [decode_ast(i, file) for i in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    if 'node' in value:
+        cls = AST_NODES[value['node']]
+        # Bypass __init__, which would redo the CommandCall path splitting
+        node = cls.__new__(cls)
+        for name, arg in zip(cls.args_list, value['args']):
+            setattr(node, name, decode_ast(arg, file))
+
+        for name, pos in zip(AST_POSITION_ATTRS, value.get('pos') or []):
+            setattr(node, name, pos)
+
+        if file is not None and 'file' in node.__dict__:
+            node.file = file
+
+        return node
+
+    if 'type' in value:
+        return LITERAL_TYPES[value['type']]
+
+    if 'tuple' in value:
+        return tuple(decode_ast(i, file) for i in value['tuple'])
+
+    if 'dict' in value:
+        return {decode_ast(k, file): decode_ast(v, file) for k, v in value['dict']}
+
+    raise ValueError('Unknown AST cache entry {0}'.format(value))
+
+
+def ast_cache_key(source):
+    h = hashlib.sha256(PARSER_SIGNATURE.encode('ascii'))
+    h.update(source.encode('utf8'))
+    return h.hexdigest()
+
+
+def read_ast_cache(path, key, file=None):
+    """
+    Returns the AST cached at `path` for `key`, or None; see decode_ast for
+    `file`. Files owned by someone else than the current user (or root), or
+    writable by group or others, are ignored, and the key on the first line
+    is checked before the rest of the file is read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if hasattr(os, 'getuid') and (st.st_uid not in (os.getuid(), 0) or st.st_mode & 0o022):
+                logger.debug('Ignoring AST cache %s not private to its owner', path)
+                return None
+
+            if f.readline(len(key) + 1).rstrip(b'\n') != key.encode('ascii'):
+                return None
+
+            ast = decode_ast(json.loads(f.read().decode('utf8')), file)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        logger.debug('Ignoring unreadable AST cache %s: %s', path, err)
+        return None
+
+    with contextlib.suppress(OSError):
+        # Recently used entries survive pruning
+        os.utime(path)
+
+    return ast
+
+
+def write_ast_cache(path, key, ast):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.ast')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key.encode('ascii') + b'\n')
+            f.write(json.dumps(encode_ast(ast), separators=(',', ':')).encode('utf8'))
+
+        os.replace(tmpname, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmpname)
+        raise
+
+
+def prune_ast_cache(max_entries=AST_CACHE_MAX_ENTRIES):
+    """
+    Removes the least recently used entries of AST_CACHE_DIR beyond
+    `max_entries`.
+    """
+    entries = []
+    with contextlib.suppress(OSError):
+        for entry in os.scandir(AST_CACHE_DIR):
+            with contextlib.suppress(OSError):
+                if entry.is_file(follow_symlinks=False):
+                    entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+
+    entries.sort(reverse=True)
+    for mtime, path in entries[max_entries:]:
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+
+def compile_file(path, target=None):
+    """
+    Parses script at `path` and stores its AST next to it (or at `target`),
+    so later `parse_file` calls can skip the parser entirely.
+    """
+    with open(path, 'rb') as f:
+        source = f.read().decode('utf8')
+
+    target = target or path + AST_CACHE_SUFFIX
+    write_ast_cache(target, ast_cache_key(source), parse(source, path))
+    return target
+
+
+def parse_file(path, use_cache=True):
+    """
+    Returns AST of script at `path`. A compiled artifact placed next to the
+    script or an entry in AST_CACHE_DIR is used when its key matches the
+    current file contents and parser; otherwise the script is parsed and
+    the result is cached for the next run.
+    """
+    with open(path, 'rb') as f:
+        source = f.read().decode('utf8')
+
+    if not use_cache:
+        return parse(source, path)
+
+    key = ast_cache_key(source)
+    for candidate in (path + AST_CACHE_SUFFIX, os.path.join(AST_CACHE_DIR, key)):
+        ast = read_ast_cache(candidate, key, path)
+        if ast is not None:
+            return ast
+
+    ast = parse(source, path)
+    try:
+        os.makedirs(AST_CACHE_DIR, 0o700, exist_ok=True)
+        write_ast_cache(os.path.join(AST_CACHE_DIR, key), key, ast)
+        prune_ast_cache()
+    except Exception as err:
+        logger.debug('Cannot cache AST of %s: %s', path, err)
+
+    return ast
+
+
 def maybe_quote(s):
     if isinstance(s, str) and not re.match(r'[\w_\-\+\*\:#\/][\w_\.\/#@\:\-\+\*\/]*', s):
         return '"{0}"'.format(s)
@@ -27,6 +27,7 @@
 
 import gettext
 import os
+import threading
 from freenas.cli.namespace import (
     EntityNamespace, Command, EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, description,
     CommandException
@@ -40,6 +41,91 @@ t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
 
+class DiskAllocationCache(object):
+    """
+    Disk ID to allocation map shared by all disk namespaces. Allocations
+    are fetched with volume.get_disks_allocation only for disks not seen
+    before and are dropped again when a disk or volume event may have
+    changed them.
+    """
+    def __init__(self, context):
+        self.context = context
+        self.allocations = {}
+        self.subscribers = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def watch(self):
+        ready = True
+        for name, handlers in (
+            ('disk', (
+                lambda entity: self.invalidate_disks(entity),
+                lambda old, new: self.invalidate_disks(old, new),
+                lambda entity: self.invalidate_disks(entity)
+            )),
+            ('volume', (
+                lambda entity: self.invalidate_volumes(entity),
+                lambda old, new: self.invalidate_volumes(old, new),
+                lambda entity: self.invalidate_volumes(entity)
+            ))
+        ):
+            subscriber = self.context.entity_subscribers.get(name)
+            if not subscriber:
+                ready = False
+                continue
+
+            with self.lock:
+                if self.subscribers.get(name) is subscriber:
+                    continue
+
+                # New or restarted subscriber; events may have been missed
+                self.subscribers[name] = subscriber
+                self.generation += 1
+                self.allocations.clear()
+
+            on_add, on_update, on_delete = handlers
+            subscriber.on_add.add(on_add)
+            subscriber.on_update.add(on_update)
+            subscriber.on_delete.add(on_delete)
+
+        return ready
+
+    def get(self, ids):
+        if not self.watch():
+            return self.context.call_sync('volume.get_disks_allocation', ids)
+
+        with self.lock:
+            missing = [i for i in ids if i not in self.allocations]
+            generation = self.generation
+
+        fetched = {}
+        if missing:
+            fetched = self.context.call_sync('volume.get_disks_allocation', missing)
+            with self.lock:
+                # Don't store allocations that changed while being fetched
+                if generation == self.generation:
+                    for i in missing:
+                        self.allocations[i] = fetched.get(i)
+
+        with self.lock:
+            return {i: fetched.get(i) if i in missing else self.allocations.get(i) for i in ids}
+
+    def invalidate_disks(self, *disks):
+        with self.lock:
+            self.generation += 1
+            for i in disks:
+                self.allocations.pop(i['id'], None)
+
+    def invalidate_volumes(self, *volumes):
+        names = {v['id'] for v in volumes}
+        with self.lock:
+            self.generation += 1
+            # Volume changes only move disks between that volume and the unallocated pool
+            for disk_id, allocation in list(self.allocations.items()):
+                if allocation is None or allocation.get('name') in names:
+                    del self.allocations[disk_id]
+
+
 @description("Provides information about installed disks")
 class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityNamespace):
     """
@@ -331,7 +417,7 @@ class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityN
 
     def query(self, params, options):
         ret = super(DisksNamespace, self).query(params, options)
-        allocations = self.context.call_sync('volume.get_disks_allocation', [d['id'] for d in ret])
+        allocations = self.context.disk_allocations.get([d['id'] for d in ret])
 
         return [extend(d, {
             'allocation': allocations.get(d['id']) if d['online'] else None
@@ -346,10 +432,7 @@ class DisksNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, EntityN
         if not ret:
             return None
 
-        ret['allocation'] = self.context.call_sync(
-            'volume.get_disks_allocation',
-            [ret['id']]
-        ).get(ret['id'])
+        ret['allocation'] = self.context.disk_allocations.get([ret['id']]).get(ret['id'])
         return ret
 
     def get_allocation(self, entity):
@@ -575,5 +658,6 @@ class ImportMediaCommand(Command):
 
 
 def _init(context):
+    context.disk_allocations = DiskAllocationCache(context)
     context.attach_namespace('/', DisksNamespace('disk', context))
     context.map_tasks('disk.*', DisksNamespace)
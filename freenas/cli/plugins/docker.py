@@ -37,7 +37,7 @@ from freenas.cli.utils import (
 )
 from freenas.utils import query as q
 from freenas.cli.complete import NullComplete, EntitySubscriberComplete, EnumComplete
-from freenas.cli.console import Console
+from freenas.cli.console import Console, capture_console
 from freenas.utils import first_or_default
 from freenas.cli.plugins.vm import StartVMCommand, StopVMCommand, RebootVMCommand, ConsoleCommand, KillVMCommand
 
@@ -1625,19 +1625,44 @@ class DockerContainerConsoleCommand(Command):
 class DockerContainerLogsCommand(Command):
     """
     Usage: logs
+           logs follow
+           logs save=<path> [rotate=<size>] [keep=<n>]
+           logs stop
 
     Examples: logs
+              logs follow
+              logs save=/mnt/tank/logs/web.log rotate=100MB keep=3
+              logs stop
 
     Shows standard output of non-interactive container's primary process.
     ^] returns to CLI
+
+    'follow' prints the output without taking over the terminal, so it
+    can be piped or used from scripts; ^C stops it. 'save' writes the
+    output to a file in the background, optionally rotating it once it
+    reaches <size> and keeping <n> old files (5 by default; 0 just
+    truncates the file), until 'stop' is used or the CLI exits.
     """
     def __init__(self, parent):
         self.parent = parent
 
     def run(self, context, args, kwargs, opargs):
+        ret = capture_console(context, self.parent.entity['id'], self.parent.entity['name'], args, kwargs)
+        if ret is not False:
+            return ret
+
         console = Console(context, self.parent.entity['id'])
         console.start()
 
+    def complete(self, context, **kwargs):
+        return [
+            NullComplete('follow'),
+            NullComplete('stop'),
+            NullComplete('save='),
+            NullComplete('rotate='),
+            NullComplete('keep=')
+        ]
+
 
 @description("Create a new process inside of a container and attach a serial console to that process")
 class DockerContainerExecConsoleCommand(Command):
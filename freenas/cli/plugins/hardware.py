@@ -29,6 +29,7 @@ import gettext
 from freenas.cli.namespace import Namespace, Command, CommandException, description, ConfigNamespace
 from freenas.cli.output import ValueType, Sequence, Object
 from freenas.cli.complete import RpcComplete
+from freenas.cli.utils import FanOut
 from freenas.cli.plugins.disks import DisksNamespace
 from freenas.cli.plugins.network import InterfacesNamespace, IPMINamespace
 
@@ -47,11 +48,8 @@ class ShowHardwareCommand(Command):
         self.parent = parent
 
     def run(self, context, args, kwargs, opargs):
-        namespaces = self.parent.namespaces()
         output_dict = {}
         output = Sequence()
-        hw_info_dict = context.call_sync('system.info.hardware')
-        parent_commands = self.parent.commands()
 
         def get_show(obj):
             if isinstance(obj, ConfigNamespace):
@@ -68,15 +66,19 @@ class ShowHardwareCommand(Command):
                 output.append("\nData about {0}:".format(key))
                 output.append(output_dict[key])
 
+        with FanOut(context) as fanout:
+            hw_info = fanout.call('system.info.hardware')
+            vm_capabilities = fanout.call('vm.get_hw_vm_capabilities')
+            shows = [(namespace.name, fanout.submit(get_show, namespace)) for namespace in self.parent.namespaces()]
 
-        for namespace in namespaces:
-            output_dict[namespace.name] = get_show(namespace)
-            append_out(namespace.name)
+            for name, show in shows:
+                output_dict[name] = show.result()
+                append_out(name)
 
-        output_dict['memory'] = Object(
-            Object.Item("Memory size", 'memory_size', hw_info_dict['memory_size'], vt=ValueType.SIZE)
-        )
-        output_dict['cpu'] = parent_commands['cpu'].run(context, '', '', '')
+            output_dict['memory'] = Object(
+                Object.Item("Memory size", 'memory_size', hw_info.result()['memory_size'], vt=ValueType.SIZE)
+            )
+            output_dict['cpu'] = ShowCPUInfoCommand.cpu_object(dict(vm_capabilities.result(), **hw_info.result()))
 
         append_out('memory')
         append_out('cpu')
@@ -95,9 +97,13 @@ class ShowCPUInfoCommand(Command):
         self.parent = parent
 
     def run(self, context, args, kwargs, opargs):
-        cpu_data = context.call_sync('vm.get_hw_vm_capabilities')
-        cpu_data.update(context.call_sync('system.info.hardware'))
+        with FanOut(context) as fanout:
+            cpu_data = fanout.call('vm.get_hw_vm_capabilities')
+            hw_info = fanout.call('system.info.hardware')
+            return self.cpu_object(dict(cpu_data.result(), **hw_info.result()))
 
+    @staticmethod
+    def cpu_object(cpu_data):
         return Object(
             Object.Item("CPU Clockrate", 'cpu_clockrate', cpu_data['cpu_clockrate']),
             Object.Item("CPU Model", 'cpu_model', cpu_data['cpu_model']),
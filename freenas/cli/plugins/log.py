@@ -26,13 +26,107 @@
 #####################################################################
 
 import gettext
-from freenas.cli.namespace import EntityNamespace, EntitySubscriberBasedLoadMixin, description
-from freenas.cli.output import ValueType
+from six.moves import queue
+from freenas.cli.namespace import (
+    EntityNamespace, EntitySubscriberBasedLoadMixin, Command, CommandException, description
+)
+from freenas.cli.output import ValueType, Table, read_value
+from freenas.cli.utils import compile_filter
 
 
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+FOLLOW_BACKLOG = 10
+FOLLOW_QUEUE_SIZE = 1000
+
+
+def follow_log(context, params, backlog=FOLLOW_BACKLOG):
+    """
+    Yields the last ``backlog`` syslog entries matching ``params`` and then
+    every new matching entry as the syslog subscriber receives it, until
+    interrupted with ^C. At most FOLLOW_QUEUE_SIZE entries wait to be
+    printed; past that the oldest waiting ones are dropped.
+    """
+    match = compile_filter(params)
+    subscriber = context.entity_subscribers['syslog']
+    entries = queue.Queue(FOLLOW_QUEUE_SIZE)
+
+    def on_add(entry):
+        if not match(entry):
+            return
+
+        while True:
+            try:
+                entries.put_nowait(entry)
+                return
+            except queue.Full:
+                try:
+                    entries.get_nowait()
+                except queue.Empty:
+                    pass
+
+    subscriber.on_add.add(on_add)
+    try:
+        last = None
+        for entry in context.call_sync('syslog.query', params, {
+            'sort': ['-seqnum'],
+            'limit': backlog,
+            'reverse': True
+        }):
+            last = entry['seqnum']
+            yield entry
+
+        while True:
+            entry = entries.get()
+            if last is not None and entry['seqnum'] <= last:
+                continue
+
+            yield entry
+    except KeyboardInterrupt:
+        return
+    finally:
+        subscriber.on_add.discard(on_add)
+
+
+@description("Prints new log entries as they arrive")
+class FollowCommand(Command):
+    """
+    Usage: follow [<key> <op> <value> ...]
+
+    Examples:
+        follow
+        follow identifier==sshd
+        follow message~="error"
+
+    Prints the last log entries matching the conditions, then keeps printing
+    new matching entries as they arrive, like tail -f. Press ^C to return to
+    the prompt.
+    """
+    def __init__(self, parent):
+        self.parent = parent
+
+    def run(self, context, args, kwargs, opargs):
+        if args or kwargs:
+            raise CommandException(_("Invalid syntax. For help see 'help follow'"))
+
+        params = []
+        for k, op, v in opargs:
+            prop = self.parent.get_mapping(k)
+            if not prop:
+                raise CommandException(_("Property {0} not found".format(k)))
+
+            if op == '==': op = '='
+            if op == '~=': op = '~'
+            params.append((prop.get, op, read_value(v, prop.type)))
+
+        cols = [
+            Table.Column(col.descr, col.do_get, col.type, col.width, col.name)
+            for col in self.parent.property_mappings if col.list
+        ]
+
+        return Table(follow_log(context, params), cols, live=True)
+
 
 @description("Browse and query system log entries")
 class LogNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
@@ -43,6 +137,9 @@ class LogNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
     def __init__(self, name, context):
         super(LogNamespace, self).__init__(name, context)
         self.entity_subscriber_name = 'syslog'
+        self.history_query_call = 'syslog.query'
+        self.large = True
+        self.projection = True
         self.primary_key_name = 'seqnum'
         self.allow_edit = False
         self.allow_create = False
@@ -84,6 +181,9 @@ class LogNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
         )
 
         self.primary_key = self.get_mapping('id')
+        self.extra_commands = {
+            'follow': FollowCommand(self)
+        }
 
     def serialize(self):
         raise NotImplementedError()
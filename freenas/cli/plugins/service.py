@@ -33,7 +33,8 @@ from freenas.cli.namespace import (
 from freenas.cli.output import ValueType, Table, Sequence
 from freenas.cli.utils import TaskPromise, post_save, get_related, set_related
 from freenas.utils import extend
-from freenas.cli.complete import EntitySubscriberComplete
+from freenas.cli.complete import EntitySubscriberComplete, NullComplete
+from freenas.cli.plugins.log import follow_log
 
 
 t = gettext.translation('freenas-cli', fallback=True)
@@ -72,12 +73,22 @@ class ServiceManageCommand(Command):
 @description("See logs of a service")
 class LogsCommand(Command):
     """
-    Usage: logs
+    Usage: logs [follow]
+
+    Examples:
+        logs
+        logs follow
+
+    Shows the last log entries of the service. With 'follow', keeps
+    printing new entries as they arrive until ^C is pressed.
     """
     def __init__(self, parent):
         self.parent = parent
 
     def run(self, context, args, kwargs, opargs):
+        if args not in ([], ['follow']):
+            raise CommandException(_("Invalid syntax {0}. For help see 'help logs'".format(args)))
+
         def get_labels(service):
             if service.get('labels'):
                 return service['labels']
@@ -93,9 +104,18 @@ class LogsCommand(Command):
 
             raise CommandException('No logs available')
 
+        params = [('service', 'in', get_labels(self.parent.entity))]
+        columns = [
+            Table.Column('Timestamp', 'timestamp', ValueType.DATE, 20),
+            Table.Column('Message', 'message')
+        ]
+
+        if args:
+            return Table(follow_log(context, params, backlog=20), columns, live=True)
+
         query = context.call_sync(
             'syslog.query',
-            [('service', 'in', get_labels(self.parent.entity))],
+            params,
             {
                 'limit': 20,
                 'sort': '-timestamp',
@@ -103,10 +123,10 @@ class LogsCommand(Command):
             }
         )
 
-        return Table(query, [
-            Table.Column('Timestamp', 'timestamp', ValueType.DATE, 20),
-            Table.Column('Message', 'message')
-        ])
+        return Table(query, columns)
+
+    def complete(self, context, **kwargs):
+        return [NullComplete('follow')]
 
 
 @description("Configure Domain Controller vm general settings")
@@ -26,16 +26,178 @@
 #####################################################################
 
 
+import re
+import time
 import gettext
+import threading
+from datetime import datetime
 from freenas.cli.namespace import (
-    Namespace, EntityNamespace, TaskBasedSaveMixin,
+    Namespace, EntityNamespace, TaskBasedSaveMixin, Command, CommandException,
     RpcBasedLoadMixin, description
 )
-from freenas.cli.output import ValueType
+from freenas.cli.output import ValueType, Table, output_is_ascii
 
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+HISTORY_TIMESPAN = '1h'
+HISTORY_MIN_RESOLUTION = 10
+SPARKLINE_WIDTH = 40
+SPARKLINE_CHARS = '\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value):
+    """
+    Returns the number of seconds in a duration: a quoted number followed
+    by one of the DURATION_UNITS, or by nothing for seconds. Unquoted
+    values are rejected, as the lexer turns them into numbers that mean
+    different things (6h is in seconds, 5m a size in bytes).
+    """
+    match = re.match(r'^(\d+)([smhd]?)$', value) if isinstance(value, str) else None
+    if not match:
+        raise CommandException(_(
+            'Invalid duration {0}. Use a quoted number followed by s, m, h or d, e.g. "30s" or "6h"'.format(value)
+        ))
+
+    seconds = int(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+    if seconds <= 0:
+        raise CommandException(_("Duration has to be positive"))
+
+    return seconds
+
+
+def sparkline(values, width=SPARKLINE_WIDTH):
+    values = [v for v in values if v is not None]
+    if not values:
+        return ''
+
+    if len(values) > width:
+        # Average into ``width`` buckets
+        step = len(values) / width
+        values = [
+            sum(b) / len(b) for b in (values[int(i * step):int((i + 1) * step)] for i in range(width)) if b
+        ]
+
+    low = min(values)
+    high = max(values)
+    scale = (len(SPARKLINE_CHARS) - 1) / (high - low) if high > low else 0
+    return ''.join(SPARKLINE_CHARS[int((v - low) * scale)] for v in values)
+
+
+class StatisticHistoryCache(object):
+    """
+    Keeps fetched time series until the server can have a new point for
+    them, i.e. for one resolution period.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, context, names, timespan, resolution):
+        key = (tuple(names), timespan, resolution)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+            # Drop whatever else has expired meanwhile
+            for k in [k for k, v in self.entries.items() if v[0] <= now]:
+                del self.entries[k]
+
+        data = context.call_sync('stat.get_data', names, {
+            'timespan': timespan,
+            'frequency': '{0}s'.format(resolution)
+        })['data']
+
+        with self.lock:
+            self.entries[key] = (now + resolution, data)
+
+        return data
+
+
+history_cache = StatisticHistoryCache()
+
+
+@description(_("Shows how statistics changed over time"))
+class HistoryCommand(Command):
+    """
+    Usage: history [timespan=<duration>] [resolution=<duration>]
+
+    Examples:
+        history
+        history timespan="1d"
+        history timespan="6h" resolution="5m"
+        history timespan="10m" resolution="30s"
+
+    Fetches the values of the statistic(s) over the last <timespan> (1h by
+    default), one point per <resolution> (by default as many points as fit
+    into a sparkline), downsampled by the server. With ascii output, shows
+    a sparkline and min/avg/max per statistic; other output formats get
+    the raw points. Durations are quoted and consist of a number followed
+    by s, m, h or d for seconds, minutes, hours or days; a number alone
+    means seconds.
+    """
+    def __init__(self, parent):
+        self.parent = parent
+
+    def run(self, context, args, kwargs, opargs):
+        if args or set(kwargs) - {'timespan', 'resolution'}:
+            raise CommandException(_("Invalid syntax. For help see 'help history'"))
+
+        timespan = parse_duration(kwargs.get('timespan', HISTORY_TIMESPAN))
+        resolution = parse_duration(kwargs['resolution']) if 'resolution' in kwargs else \
+            max(timespan // SPARKLINE_WIDTH, HISTORY_MIN_RESOLUTION)
+
+        if getattr(self.parent, 'entity', None):
+            stats = [self.parent.entity]
+        else:
+            stats = list(self.parent.query([], {}))
+
+        if not stats:
+            return
+
+        data = history_cache.get(context, [s['name'] for s in stats], timespan, resolution)
+
+        if not output_is_ascii():
+            def points():
+                for row in data:
+                    for idx, stat in enumerate(stats):
+                        if row[idx + 1] is not None:
+                            yield {
+                                'timestamp': datetime.fromtimestamp(row[0]),
+                                'name': stat['short_name'],
+                                'value': row[idx + 1]
+                            }
+
+            return Table(points(), [
+                Table.Column(_('Time'), 'timestamp', ValueType.TIME),
+                Table.Column(_('Name'), 'name'),
+                Table.Column(_('Value'), 'value', ValueType.NUMBER)
+            ])
+
+        summary = []
+        for idx, stat in enumerate(stats):
+            values = [row[idx + 1] for row in data if row[idx + 1] is not None]
+            summary.append({
+                'name': stat['short_name'],
+                'min': min(values) if values else None,
+                'avg': round(sum(values) / len(values), 2) if values else None,
+                'max': max(values) if values else None,
+                'unit': stat.get('unit'),
+                'history': sparkline(values)
+            })
+
+        return Table(summary, [
+            Table.Column(_('Name'), 'name'),
+            Table.Column(_('Min'), 'min', ValueType.NUMBER),
+            Table.Column(_('Avg'), 'avg', ValueType.NUMBER),
+            Table.Column(_('Max'), 'max', ValueType.NUMBER),
+            Table.Column(_('Unit'), 'unit'),
+            Table.Column(_('History'), 'history')
+        ])
+
 
 class StatisticNamespaceBase(TaskBasedSaveMixin, RpcBasedLoadMixin, EntityNamespace):
     def __init__(self, name, context):
@@ -107,6 +269,13 @@ class StatisticNamespaceBase(TaskBasedSaveMixin, RpcBasedLoadMixin, EntityNamesp
             type=ValueType.BOOLEAN)
 
         self.primary_key = self.get_mapping('name')
+        self.entity_commands = lambda this: {
+            'history': HistoryCommand(this)
+        }
+
+        self.extra_commands = {
+            'history': HistoryCommand(self)
+        }
 
 
 @description(_("View CPUs statistics and set alert levels"))
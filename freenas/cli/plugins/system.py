@@ -27,7 +27,6 @@
 
 import gettext
 import math
-from pathlib import Path
 from freenas.cli.namespace import (
     Namespace, ConfigNamespace, Command, CommandException, description,
     RpcBasedLoadMixin, EntityNamespace, TaskBasedSaveMixin
@@ -35,9 +34,9 @@ from freenas.cli.namespace import (
 from freenas.cli.output import (
     Object, Table, Sequence, ValueType, format_value, output_msg, read_value
 )
-from freenas.cli.utils import TaskPromise, post_save, parse_timedelta, set_related, get_related
-from freenas.cli.complete import NullComplete, EntitySubscriberComplete, RpcComplete
-from freenas.dispatcher.fd import FileDescriptor
+from freenas.cli.utils import FanOut, TaskPromise, post_save, parse_timedelta, set_related, get_related
+from freenas.cli.complete import NullComplete, EnumComplete, EntitySubscriberComplete, RpcComplete
+from freenas.cli.transfer import COMPRESSORS, DECOMPRESSORS, download, upload
 
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
@@ -164,35 +163,45 @@ class InfoCommand(Command):
                 output.append("\nData about {0}:".format(key))
                 output.append(output_dict[key])
 
-        for namespace in root_namespaces:
-            if namespace.name in ('system', 'service', 'vm', 'disk', 'share', 'volume'):
-                output_dict[namespace.name] = get_show(namespace)
-
-            elif namespace.name == 'account':
-                for account_nested_namespace in namespace.namespaces():
-                    if account_nested_namespace.name == 'directoryservice':
-                        for nested_namespace in account_nested_namespace.namespaces():
-                            if nested_namespace.name == 'directories':
-                                output_dict[nested_namespace.name] = get_show(nested_namespace)
-                            if nested_namespace.name == 'kerberos':
-                                for kerberos_namespace in nested_namespace.namespaces():
-                                    if kerberos_namespace.name == 'keytab' or \
-                                                    kerberos_namespace.name == 'realm':
-                                        output_dict[kerberos_namespace.name] = get_show(kerberos_namespace)
-
-            elif namespace.name == 'network':
-                for nested_namespace in namespace.namespaces():
-                    if nested_namespace.name == 'config' or \
-                                    nested_namespace.name == 'host' or \
-                                    nested_namespace.name == 'interface' or \
-                                    nested_namespace.name == 'route':
-                        output_dict[nested_namespace.name] = get_show(nested_namespace)
-            elif namespace.name == 'boot':
-                for nested_namespace in namespace.namespaces():
-                    if nested_namespace.name == 'environment':
-                        output_dict[nested_namespace.name] = get_show(nested_namespace)
-
-        hw_info_dict = context.call_sync('system.info.hardware')
+        shows = {}
+        with FanOut(context) as fanout:
+            hw_info = fanout.call('system.info.hardware')
+            version = fanout.call('system.info.version')
+
+            for namespace in root_namespaces:
+                if namespace.name in ('system', 'service', 'vm', 'disk', 'share', 'volume'):
+                    shows[namespace.name] = fanout.submit(get_show, namespace)
+
+                elif namespace.name == 'account':
+                    for account_nested_namespace in namespace.namespaces():
+                        if account_nested_namespace.name == 'directoryservice':
+                            for nested_namespace in account_nested_namespace.namespaces():
+                                if nested_namespace.name == 'directories':
+                                    shows[nested_namespace.name] = fanout.submit(get_show, nested_namespace)
+                                if nested_namespace.name == 'kerberos':
+                                    for kerberos_namespace in nested_namespace.namespaces():
+                                        if kerberos_namespace.name == 'keytab' or \
+                                                        kerberos_namespace.name == 'realm':
+                                            shows[kerberos_namespace.name] = fanout.submit(get_show, kerberos_namespace)
+
+                elif namespace.name == 'network':
+                    for nested_namespace in namespace.namespaces():
+                        if nested_namespace.name == 'config' or \
+                                        nested_namespace.name == 'host' or \
+                                        nested_namespace.name == 'interface' or \
+                                        nested_namespace.name == 'route':
+                            shows[nested_namespace.name] = fanout.submit(get_show, nested_namespace)
+                elif namespace.name == 'boot':
+                    for nested_namespace in namespace.namespaces():
+                        if nested_namespace.name == 'environment':
+                            shows[nested_namespace.name] = fanout.submit(get_show, nested_namespace)
+
+            for name, show in shows.items():
+                output_dict[name] = show.result()
+
+            hw_info_dict = hw_info.result()
+            ver_info = version.result()
+
         output_dict['hardware'] = Object(
             Object.Item("CPU Clockrate", 'cpu_clockrate', hw_info_dict['cpu_clockrate']),
             Object.Item("CPU Model", 'cpu_model', hw_info_dict['cpu_model']),
@@ -201,8 +210,6 @@ class InfoCommand(Command):
             Object.Item("VM Guest", 'vm_guest', hw_info_dict['vm_guest'])
         )
 
-        ver_info = context.call_sync('system.info.version')
-
         output.append("System version: {0}".format(ver_info))
         output.append("\n\nStatus of machine:")
         append_out('system')
@@ -298,11 +305,16 @@ class FactoryRestoreCommand(Command):
 @description("Stores FreeNAS config to a file")
 class DownloadConfigCommand(Command):
     """
-    Usage: download path=/abs/path/to/target/file
+    Usage: download path=/abs/path/to/target/file [compress=gzip|xz|bz2] [verify=yes]
 
     Examples: / system config download path=/mnt/mypool/mydir/myconfig.db
+              / system config download path=/mnt/mypool/mydir/myconfig.db.xz compress=xz verify=yes
 
-    Stores FreeNAS configuration database to the selected file.
+    Stores FreeNAS configuration database to the selected file, optionally
+    compressed. Prints the SHA-256 of the database; with verify=yes it is
+    also checked against the checksum reported by the server, and the
+    command fails if the server does not report one. The file is only
+    written once the download succeeded.
     """
 
     def run(self, context, args, kwargs, opargs):
@@ -312,24 +324,32 @@ class DownloadConfigCommand(Command):
             raise CommandException(_("Please specify path to the target config file."
                                      "For help see 'help download'"))
 
-        p = Path(kwargs['path'])
-        with p.open('w') as fo:
-            context.call_task_sync('database.dump', FileDescriptor(fd=fo.fileno(), close=False))
+        digest = download(
+            context, _('Config download'), 'database.dump', [None], kwargs['path'],
+            kwargs.get('compress'), read_value(kwargs.get('verify', False), ValueType.BOOLEAN)
+        )
+        return _("SHA-256: {0}".format(digest))
 
     def complete(self, context, **kwargs):
         return [
             NullComplete('path='),
+            EnumComplete('compress=', list(COMPRESSORS)),
+            EnumComplete('verify=', ['yes', 'no'])
         ]
 
 
 @description("Restores FreeNAS config from a file")
 class UploadConfigCommand(Command):
     """
-    Usage: upload path=/abs/path/to/source/file
+    Usage: upload path=/abs/path/to/source/file [decompress=gzip|xz|bz2]
 
     Examples: / system config upload path=/mnt/mypool/mydir/myconfig.db
+              / system config upload path=/mnt/mypool/mydir/myconfig.db.xz decompress=xz
 
-    Restores FreeNAS configuration database from the selected file.
+    Restores FreeNAS configuration database from the selected file. A file
+    saved with 'download compress=...' has to be uploaded with the same
+    decompress=... option, it is then decompressed on the fly; without it
+    the file is sent as it is. Prints the SHA-256 of the data sent.
     """
 
     def run(self, context, args, kwargs, opargs):
@@ -339,25 +359,33 @@ class UploadConfigCommand(Command):
             raise CommandException(_("Please specify path to the source config file."
                                      "For help see 'help upload'"))
 
-        p = Path(kwargs['path'])
-        with p.open('r') as fo:
-            output_msg(_('Restoring the Database. Reboot will occur immediately after the restore operation.'))
-            context.call_task_sync('database.restore', FileDescriptor(fd=fo.fileno(), close=False))
+        output_msg(_('Restoring the Database. Reboot will occur immediately after the restore operation.'))
+        digest = upload(
+            context, _('Config upload'), 'database.restore', [None], kwargs['path'],
+            kwargs.get('decompress')
+        )
+        return _("SHA-256: {0}".format(digest))
 
     def complete(self, context, **kwargs):
         return [
             NullComplete('path='),
+            EnumComplete('decompress=', list(DECOMPRESSORS))
         ]
 
 
 @description("Downloads freenas debug file to the path specified")
 class DownloadDebugCommand(Command):
     """
-    Usage: download path=/abs/path/to/target/file
+    Usage: download path=/abs/path/to/target/file [compress=gzip|xz|bz2] [verify=yes]
 
     Examples: / system debug download path=/mnt/mypool/mydir/freenasdebug.tar.gz
+              / system debug download path=/mnt/mypool/mydir/freenasdebug.tar.gz.xz compress=xz
 
-    Downloads freenas debug file to the path specified.
+    Downloads freenas debug file to the path specified, optionally
+    compressed. Prints the SHA-256 of the debug file; with verify=yes it is
+    also checked against the checksum reported by the server, and the
+    command fails if the server does not report one. The file is only
+    written once the download succeeded.
     """
 
     def run(self, context, args, kwargs, opargs):
@@ -367,13 +395,17 @@ class DownloadDebugCommand(Command):
             raise CommandException(_("Please specify path to the target debug file."
                                      "For help see 'help download'"))
 
-        p = Path(kwargs['path'])
-        with p.open('w') as fo:
-            context.call_task_sync('debug.collect', FileDescriptor(fd=fo.fileno(), close=False))
+        digest = download(
+            context, _('Debug download'), 'debug.collect', [None], kwargs['path'],
+            kwargs.get('compress'), read_value(kwargs.get('verify', False), ValueType.BOOLEAN)
+        )
+        return _("SHA-256: {0}".format(digest))
 
     def complete(self, context, **kwargs):
         return [
             NullComplete('path='),
+            EnumComplete('compress=', list(COMPRESSORS)),
+            EnumComplete('verify=', ['yes', 'no'])
         ]
 
 
@@ -175,8 +175,10 @@ class TasksNamespace(EntitySubscriberBasedLoadMixin, EntityNamespace):
         self.allow_create = False
         self.allow_edit = False
         self.entity_subscriber_name = 'task'
+        self.history_query_call = 'task.query'
         self.default_sort = 'id'
         self.large = True
+        self.projection = True
 
         self.add_property(
             descr='ID',
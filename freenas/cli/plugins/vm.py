@@ -36,7 +36,7 @@ from freenas.cli.utils import TaskPromise, post_save, EntityPromise, get_item_st
 from freenas.utils import first_or_default
 from freenas.utils.query import get, set
 from freenas.cli.complete import NullComplete, EntitySubscriberComplete, RpcComplete, MultipleSourceComplete
-from freenas.cli.console import Console
+from freenas.cli.console import Console, capture_console
 
 
 t = gettext.translation('freenas-cli', fallback=True)
@@ -118,18 +118,42 @@ class RebootVMCommand(Command):
 class ConsoleCommand(Command):
     """
     Usage: console
+           console follow
+           console save=<path> [rotate=<size>] [keep=<n>]
+           console stop
 
     Examples: console
+              console follow
+              console save=/mnt/tank/logs/vm.log rotate=100MB
 
     Connects to VM serial console. ^] returns to CLI
+
+    'follow' prints the console output without taking over the terminal,
+    so it can be piped or used from scripts; ^C stops it. 'save' writes
+    the output to a file in the background, optionally rotating it once
+    it reaches <size> and keeping <n> old files (5 by default; 0 just
+    truncates the file), until 'stop' is used or the CLI exits.
     """
     def __init__(self, parent):
         self.parent = parent
 
     def run(self, context, args, kwargs, opargs):
+        ret = capture_console(context, self.parent.entity['id'], self.parent.entity['name'], args, kwargs)
+        if ret is not False:
+            return ret
+
         console = Console(context, self.parent.entity['id'])
         console.start()
 
+    def complete(self, context, **kwargs):
+        return [
+            NullComplete('follow'),
+            NullComplete('stop'),
+            NullComplete('save='),
+            NullComplete('rotate='),
+            NullComplete('keep=')
+        ]
+
 
 @description("Clones a VM into a new VM instance")
 class CloneVMCommand(Command):
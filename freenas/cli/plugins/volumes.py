@@ -1460,6 +1460,7 @@ class SnapshotsNamespace(EntitySubscriberBasedLoadMixin, TaskBasedSaveMixin, Ent
         self.primary_key_name = 'id'
         self.required_props = ['name']
         self.large = True
+        self.projection = True
 
         if parent and parent.entity:
             self.extra_query_params = [
@@ -1692,6 +1693,8 @@ class CreateVolumeCommand(Command):
             raise CommandException(_("Please specify one or more disks using the disks property"))
         else:
             disks = kwargs.pop('disks')
+            if disks != 'auto':
+                disks = to_list(disks)
 
         key_encryption = read_value(kwargs.pop('key_encryption', False), ValueType.BOOLEAN)
         password = kwargs.get('password')
@@ -1706,12 +1709,8 @@ class CreateVolumeCommand(Command):
         if password is not None:
             password = Password(str(password))
 
-        cache_disks = kwargs.pop('cache', [])
-        log_disks = kwargs.pop('log', [])
-        if cache_disks is None:
-            cache_disks = []
-        if log_disks is None:
-            log_disks = []
+        cache_disks = to_list(kwargs.pop('cache', None) or [])
+        log_disks = to_list(kwargs.pop('log', None) or [])
 
         ns = SingleItemNamespace(name, self.parent, context)
         ns.orig_entity = copy.deepcopy(self.parent.skeleton_entity)
@@ -27,6 +27,8 @@
 #####################################################################
 
 import copy
+import itertools
+import atexit
 import enum
 import sys
 import os
@@ -52,6 +54,7 @@ from six.moves.urllib.parse import urlparse
 from socket import gaierror as socket_error
 from freenas.cli.output import Table
 from freenas.cli.descriptions import events
+from freenas.cli.complete import CompletionCache
 from freenas.cli.utils import SIGTSTPException, SIGTSTP_setter, errors_by_path, quote, flatten_table
 from freenas.cli import functions
 from freenas.cli import config
@@ -60,15 +63,15 @@ from freenas.cli.namespace import (
     FilteringCommand, PipeCommand, CommandException
 )
 from freenas.cli.parser import (
-    parse, unparse, Symbol, Literal, BinaryParameter, UnaryExpr, BinaryExpr, PipeExpr, AssignmentStatement,
+    parse, parse_file, unparse, Symbol, Literal, BinaryParameter, UnaryExpr, BinaryExpr, PipeExpr, AssignmentStatement,
     IfStatement, ForStatement, ForInStatement, WhileStatement, FunctionCall, CommandCall, Subscript,
     ExpressionExpansion, CommandExpansion, SyncCommandExpansion, FunctionDefinition, ReturnStatement,
     BreakStatement, UndefStatement, AssertStatement, Redirection, AnonymousFunction, ShellEscape,
     Parentheses, ConstStatement, Quote
 )
 from freenas.cli.output import (
-    ValueType, ProgressBar, output_lock, output_msg, read_value, format_value,
-    format_output, output_msg_locked
+    ValueType, ProgressDisplay, output_lock, output_msg, read_value, format_value,
+    format_output, output_msgs_locked, set_active_formatter
 )
 from freenas.dispatcher.client import Client, ClientError
 from freenas.dispatcher.entity import EntitySubscriber
@@ -78,12 +81,12 @@ from freenas.utils.query import get
 from freenas.cli.commands import (
     ExitCommand, PrintoptCommand, SetoptCommand, SetenvCommand, PrintenvCommand,
     ShellCommand, HelpCommand, ShowUrlsCommand, ShowIpsCommand, TopCommand, ClearCommand,
-    HistoryCommand, SaveoptCommand, EchoCommand, SourceCommand, MorePipeCommand,
+    HistoryCommand, SaveoptCommand, EchoCommand, SourceCommand, CompileCommand, MorePipeCommand,
     SearchPipeCommand, ExcludePipeCommand, SortPipeCommand, LimitPipeCommand, TailPipeCommand,
     SelectPipeCommand, FindPipeCommand, LoginCommand, DumpCommand, WhoamiCommand, PendingCommand,
     WaitCommand, OlderThanPipeCommand, NewerThanPipeCommand, IndexCommand, AliasCommand,
     UnaliasCommand, ListVarsCommand, AttachDebuggerCommand,
-    WCommand, TimeCommand, RemoteCommand, BuiltinCommand
+    WCommand, TimeCommand, WatchCommand, RemoteCommand, BuiltinCommand
 )
 from freenas.cli.docgen import CliDocGen
 
@@ -116,6 +119,12 @@ _ = t.gettext
 
 
 PROGRESS_CHARS = ['-', '\\', '|', '/']
+TASK_NOTIFICATIONS_THRESHOLD = 5
+WILDCARD_CHARS = frozenset('*?[]^$+(){}|\\')
+HISTORY_SUBSCRIBERS = {
+    'syslog': lambda entry: False,
+    'task': lambda task: task['state'] not in ('FINISHED', 'FAILED', 'ABORTED')
+}
 EVENT_MASKS = [
     'client.logged',
     'task.progress',
@@ -187,6 +196,10 @@ def sort_args(args):
     return positional, kwargs, opargs
 
 
+def has_wildcards(value):
+    return isinstance(value, six.string_types) and not WILDCARD_CHARS.isdisjoint(value)
+
+
 def expand_wildcards(context, args, kwargs, opargs, completions):
     def expand_one(value, completion):
         choices = completion.choices(context, None)
@@ -198,7 +211,7 @@ def expand_wildcards(context, args, kwargs, opargs, completions):
             continue
 
         if isinstance(i.name, six.integer_types):
-            if not len(args) >= i.name or not isinstance(kwargs[name], six.string_types):
+            if len(args) <= i.name or not has_wildcards(args[i.name]):
                 continue
 
             args[i.name] = expand_one(args[i.name], i)
@@ -206,7 +219,7 @@ def expand_wildcards(context, args, kwargs, opargs, completions):
         if isinstance(i.name, six.string_types):
             name, op = i.name[:-1], i.name[-1]
             if op == '=':
-                if name not in kwargs or not isinstance(kwargs[name], six.string_types):
+                if name not in kwargs or not has_wildcards(kwargs[name]):
                     continue
 
                 kwargs[name] = expand_one(kwargs[name], i)
@@ -230,6 +243,22 @@ def convert_to_literals(tokens):
     return [conv(i) for i in tokens]
 
 
+def merge_filter_params(params, new):
+    for k, v in new.items():
+        if k == 'select' and 'select' in params:
+            # A later select picks from the columns of the first one, which
+            # decides what is queried
+            missing = [f for f in v if f not in params['select']]
+            if missing:
+                raise CommandException(_('Field {0} is not selected by the preceding select'.format(
+                    ', '.join(missing)
+                )))
+
+            continue
+
+        params[k] = v
+
+
 class FlowControlInstructionType(enum.Enum):
     RETURN = 'RETURN'
     BREAK = 'BREAK'
@@ -264,7 +293,7 @@ class VariableStore(object):
     def __init__(self):
         self.save_to_file = DEFAULT_CLI_CONFIGFILE
         self.variables = {
-            'output_format': self.Variable('ascii', ValueType.STRING, ['ascii', 'json']),
+            'output_format': self.Variable('ascii', ValueType.STRING, ['ascii', 'json', 'ndjson', 'csv', 'tsv']),
             'datetime_format': self.Variable('natural', ValueType.STRING),
             'language': self.Variable(os.getenv('LANG', 'C'), ValueType.STRING),
             'prompt': self.Variable('{jobs_short}{host}:{path}>', ValueType.STRING),
@@ -275,6 +304,8 @@ class VariableStore(object):
             'abort_on_errors': self.Variable(False, ValueType.BOOLEAN),
             'output': self.Variable(None, ValueType.STRING),
             'verbosity': self.Variable(1, ValueType.NUMBER),
+            'notification_interval': self.Variable(100, ValueType.NUMBER),
+            'history_size': self.Variable(10000, ValueType.NUMBER),
             'rollbar_enabled': self.Variable(True, ValueType.BOOLEAN),
             'vm.console_interrupt': self.Variable(r'\035', ValueType.STRING),
             'cli_src_path': self.Variable(
@@ -282,7 +313,7 @@ class VariableStore(object):
             )
         }
         self.variable_doc = {
-            'output_format': _('Console output format. Can be set to \'ascii\' or \'json\'.'),
+            'output_format': _('Console output format. Can be set to \'ascii\', \'json\', \'ndjson\', \'csv\' or \'tsv\'.'),
             'datetime_format': _('Date and time format.'),
             'language': _('Display the console language.'),
             'prompt': _('Console prompt.'),
@@ -293,6 +324,8 @@ class VariableStore(object):
             'abort_on_errors': _('Can be set to yes or no. When set to yes, command execution will abort on command errors.'),
             'output': _('Either send all output to specified file or set to \'none\' to display output on the console.'),
             'verbosity': _('Increasing verbosity of event messages. Can be set from 1 to 5.'),
+            'notification_interval': _('Minimum time in milliseconds between two redraws of event and task messages. Messages arriving in between are shown together, task state changes as a summary.'),
+            'history_size': _('Number of log entries and finished tasks kept in memory. Older ones are fetched from the server when a command asks for them.'),
             'rollbar_enabled': _('Toggle rollbar error reporting. Can be set to yes or no.'),
             'vm.console_interrupt': _(r'Set the console interrupt key sequence for virtual machines with support for octal characters of the form \nnn. Default is ^] or octal 035.'),
             'cli_src_path': _('The absolute path of the cli source code on this machine')
@@ -358,7 +391,204 @@ class VariableStore(object):
         if name not in self.variables:
             self.variables[name] = self.Variable(default, vtype, choices)
 
+        old = self.variables[name].value
         self.variables[name].set(value)
+        if name == 'output_format':
+            set_active_formatter(self.variables[name].value)
+
+        if name == 'output' and old and config.instance:
+            config.instance.output_sinks.close(old)
+
+
+class TaskNotification(object):
+    def __init__(self, state, message):
+        self.state = state
+        self.message = message
+
+
+class OutputSinks(object):
+    """
+    Files written by output redirection and the ``output`` variable. They
+    are kept open with a large buffer instead of being reopened for every
+    result; a sink is locked for the duration of one result, so output of
+    concurrent producers does not interleave. Sinks written to are flushed
+    at the end of every top-level statement.
+    """
+    BUFFER_SIZE = 1024 * 1024
+
+    class Sink(object):
+        def __init__(self, path):
+            self.lock = threading.RLock()
+            self.file = open(path, 'a', buffering=OutputSinks.BUFFER_SIZE)
+            self.dirty = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sinks = {}
+
+    @contextlib.contextmanager
+    def acquire(self, path):
+        path = os.path.abspath(path)
+        while True:
+            with self.lock:
+                sink = self.sinks.get(path)
+                if not sink:
+                    sink = self.sinks[path] = self.Sink(path)
+
+            with sink.lock:
+                # Sink might have been closed while we were waiting for it
+                if sink.file.closed:
+                    continue
+
+                sink.dirty = True
+                yield sink.file
+                return
+
+    def flush(self):
+        with self.lock:
+            sinks = list(self.sinks.values())
+
+        for sink in sinks:
+            if not sink.dirty:
+                continue
+
+            with sink.lock:
+                if not sink.file.closed:
+                    sink.file.flush()
+                    sink.dirty = False
+
+    def close(self, path=None):
+        with self.lock:
+            if path is None:
+                sinks = list(self.sinks.values())
+                self.sinks.clear()
+            else:
+                sink = self.sinks.pop(os.path.abspath(path), None)
+                sinks = [sink] if sink else []
+
+        for sink in sinks:
+            with sink.lock:
+                sink.file.close()
+
+
+class HistoryRetention(object):
+    """
+    Caps the number of entities kept by the syslog and task subscribers at
+    the ``history_size`` variable. The oldest entities are evicted first,
+    except those the subscriber's keep predicate in HISTORY_SUBSCRIBERS
+    selects (unfinished tasks). Namespaces query the server for anything
+    older once a subscriber has been truncated.
+    """
+    SLACK = 0.1
+
+    def __init__(self, context):
+        self.context = context
+        self.subscribers = {}
+        self.truncated = set()
+        self.lock = threading.Lock()
+
+    def watch(self, name, subscriber):
+        with self.lock:
+            self.subscribers[name] = subscriber
+            self.truncated.discard(name)
+
+        subscriber.on_add.add(lambda entity: self.trim(name))
+
+    def is_truncated(self, name):
+        with self.lock:
+            return name in self.truncated
+
+    def trim(self, name):
+        """
+        Called from the subscriber's on_add handler, that is from the thread
+        applying the subscriber's changes, so nothing else writes to its
+        items meanwhile. Readers may be iterating over the items from other
+        threads, hence the survivors are collected into a new mapping that
+        replaces the old one in a single assignment instead of popping
+        entries in place.
+        """
+        subscriber = self.subscribers.get(name)
+        if not subscriber:
+            return
+
+        size = self.context.variables.get('history_size')
+        items = subscriber.items
+        # Evict in batches rather than one entity per event
+        if len(items) <= size * (1 + self.SLACK):
+            return
+
+        with self.lock:
+            keep = HISTORY_SUBSCRIBERS[name]
+            excess = len(items) - size
+            trimmed = items.__class__()
+            for key, entity in list(items.items()):
+                if excess > 0 and not keep(entity):
+                    excess -= 1
+                    continue
+
+                trimmed[key] = entity
+
+            subscriber.items = trimmed
+            self.truncated.add(name)
+
+
+class CountingClient(Client):
+    """
+    Client counting the calls made through it, which lets watch tell
+    whether a command got its output from RPCs or from entity subscribers
+    only. Calls made directly on the connection are counted as well.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingClient, self).__init__(*args, **kwargs)
+        self.calls = 0
+
+    def call_sync(self, *args, **kwargs):
+        self.calls += 1
+        return super(CountingClient, self).call_sync(*args, **kwargs)
+
+    def call_async(self, *args, **kwargs):
+        self.calls += 1
+        return super(CountingClient, self).call_async(*args, **kwargs)
+
+    def call_task_sync(self, *args, **kwargs):
+        self.calls += 1
+        return super(CountingClient, self).call_task_sync(*args, **kwargs)
+
+
+class EntitySubscribers(dict):
+    """
+    The context's entity subscribers. While a recording is active, lookups
+    of subscribers by name are remembered, so watch can learn which of them
+    a command read from.
+    """
+    def __init__(self):
+        super(EntitySubscribers, self).__init__()
+        self.recordings = []
+
+    @property
+    def recording(self):
+        return bool(self.recordings)
+
+    @contextlib.contextmanager
+    def record(self):
+        used = set()
+        self.recordings = self.recordings + [used]
+        try:
+            yield used
+        finally:
+            self.recordings = [i for i in self.recordings if i is not used]
+
+    def __getitem__(self, name):
+        for used in self.recordings:
+            used.add(name)
+
+        return super(EntitySubscribers, self).__getitem__(name)
+
+    def get(self, name, default=None):
+        for used in self.recordings:
+            used.add(name)
+
+        return super(EntitySubscribers, self).get(name, default)
 
 
 class Context(object):
@@ -367,9 +597,11 @@ class Context(object):
         self.uri = None
         self.parsed_uri = None
         self.hostname = None
-        self.connection = Client()
+        self.connection = CountingClient()
         self.ml = None
         self.logger = logging.getLogger('cli')
+        self.output_sinks = OutputSinks()
+        self.history_retention = HistoryRetention(self)
         self.plugin_dirs = []
         self.task_callbacks = {}
         self.plugins = {}
@@ -382,17 +614,19 @@ class Context(object):
         self.output_queue = six.moves.queue.Queue()
         self.keepalive_timer = None
         self.argparse_parser = None
-        self.entity_subscribers = {}
+        self.entity_subscribers = EntitySubscribers()
         self.call_stack = [CallStackEntry('<stdin>', [], '<stdin>', 1, 1)]
         self.builtin_operators = functions.operators
         self.builtin_functions = functions.functions
         self.global_env = Environment(self)
         self.user = None
         self.pending_tasks = {}
+        self.progress = None
         self.session_id = None
         self.user_commands = []
         self.local_connection = False
         config.instance = self
+        atexit.register(self.output_sinks.close)
 
         self.output_thread = threading.Thread(target=self.output_thread)
         self.output_thread.daemon = True
@@ -422,6 +656,8 @@ class Context(object):
             e = EntitySubscriber(self.connection, i)
             e.start()
             self.entity_subscribers[i] = e
+            if i in HISTORY_SUBSCRIBERS:
+                self.history_retention.watch(i, e)
 
         def update_task(task, old_task=None):
             self.pending_tasks[task['id']] = task
@@ -430,40 +666,42 @@ class Context(object):
             if task['description']:
                 descr = task['description']['message']
 
+            self.update_progress(task)
+
             if task['state'] in ('FINISHED', 'FAILED', 'ABORTED'):
                 del self.pending_tasks[task['id']]
 
             if self.variables.get('verbosity') > 1 and task['state'] in ('CREATED', 'FINISHED'):
-                self.output_queue.put(_(
+                self.output_queue.put(TaskNotification(task['state'], _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if self.variables.get('verbosity') > 2 and task['state'] == 'WAITING':
-                self.output_queue.put(_(
+                self.output_queue.put(TaskNotification(task['state'], _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if task['state'] == 'FAILED':
                 if self.variables.get('verbosity') > 0 and (not task['parent'] or self.variables.get('verbosity') > 1):
-                    self.output_queue.put(_(
+                    self.output_queue.put(TaskNotification(task['state'], _(
                         "Task #{0} error: {1}".format(
                             task['id'],
                             task['error'].get('message', '') if task.get('error') else ''
                         )
-                    ))
+                    )))
 
                     self.print_validation_errors(task)
 
             if task['state'] == 'ABORTED':
-                self.output_queue.put(_("Task #{0} aborted".format(task['id'])))
+                self.output_queue.put(TaskNotification(task['state'], _("Task #{0} aborted".format(task['id']))))
 
             if task['id'] in self.task_callbacks:
                 self.handle_task_callback(task)
@@ -670,6 +908,10 @@ class Context(object):
             if task['id'] in self.pending_tasks:
                 self.pending_tasks[data['id']]['progress'] = progress
 
+            display = self.progress
+            if display:
+                display.update(data['id'], progress.get('percentage'), progress.get('message'))
+
         self.print_event(event, data)
 
     def get_validation_errors(self, task):
@@ -740,9 +982,42 @@ class Context(object):
                 )))
 
     def output_thread(self):
+        last_frame = 0
         while True:
-            item = self.output_queue.get()
-            output_msg_locked(item)
+            batch = [self.output_queue.get()]
+
+            # Render at most one frame per interval; whatever arrives in
+            # the meantime is drawn together with a single prompt redraw
+            delay = last_frame + self.variables.get('notification_interval') / 1000 - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            while True:
+                try:
+                    batch.append(self.output_queue.get_nowait())
+                except six.moves.queue.Empty:
+                    break
+
+            output_msgs_locked(self.coalesce_notifications(batch))
+            last_frame = time.monotonic()
+
+    def coalesce_notifications(self, batch):
+        tasks = [i for i in batch if isinstance(i, TaskNotification)]
+        if len(tasks) <= TASK_NOTIFICATIONS_THRESHOLD:
+            return [i.message if isinstance(i, TaskNotification) else i for i in batch]
+
+        # Routine task state changes are replaced by a summary line, errors
+        # and aborts are still shown one by one
+        result = [
+            i.message if isinstance(i, TaskNotification) else i
+            for i in batch if not isinstance(i, TaskNotification) or i.state in ('FAILED', 'ABORTED')
+        ]
+        counts = collections.Counter(i.state for i in tasks)
+        result.append(_('Tasks: {0}').format(', '.join(
+            '{0} {1}'.format(counts[state], state.lower())
+            for state in ('CREATED', 'WAITING', 'FINISHED', 'FAILED', 'ABORTED') if counts[state]
+        )))
+        return result
 
     def handle_task_callback(self, data):
         if data['state'] in ('FINISHED', 'CANCELLED', 'ABORTED', 'FAILED'):
@@ -780,68 +1055,85 @@ class Context(object):
         self.global_env['_last_task_id'] = Environment.Variable(tid)
         return tid
 
-    def wait_for_task_with_progress(self, tid):
-        def update(progress, task):
-            message = task['progress']['message'] if 'progress' in task else task['state']
-            percentage = task['progress']['percentage'] if 'progress' in task else None
-            progress.update(percentage=percentage, message=message)
+    def update_progress(self, task):
+        display = self.progress
+        if not display:
+            return
+
+        progress = task.get('progress') or {}
+        display.update(
+            task['id'],
+            progress.get('percentage'),
+            progress.get('message') or task['state'].lower(),
+            task['state'] if task['state'] in ('FINISHED', 'FAILED', 'ABORTED') else None
+        )
 
-        generator = None
-        progress = None
+    def wait_for_task_with_progress(self, tid):
+        return self.wait_for_tasks_with_progress([tid])
 
-        try:
+    def wait_for_tasks_with_progress(self, tids):
+        tasks = []
+        for tid in tids:
             task = self.entity_subscribers['task'].get(tid, timeout=5)
             if not task:
                 return _("Task {0} not found".format(tid))
 
             if task['state'] in ('FINISHED', 'FAILED', 'ABORTED'):
-                return _("The task with id: {0} ended in {1} state".format(tid, task['state']))
+                if len(tids) == 1:
+                    return _("The task with id: {0} ended in {1} state".format(tid, task['state']))
+                continue
+
+            tasks.append(task)
+
+        if not tasks:
+            return _("All specified tasks have already ended")
+
+        tids = [t['id'] for t in tasks]
 
+        def end_progress():
+            if self.progress:
+                self.progress.end()
+                self.progress = None
+
+        try:
             # lets set the SIGTSTP (Ctrl+Z) handler
             SIGTSTP_setter(set_flag=True)
             output_msg(_("Hit Ctrl+C to terminate task if needed"))
             output_msg(_("To background running task press 'Ctrl+Z'"))
 
-            progress = ProgressBar()
-            update(progress, task)
-            generator = self.entity_subscribers['task'].listen(tid)
-
-            for op, old, new in generator:
-                update(progress, new)
+            progress = ProgressDisplay()
+            for task in tasks:
+                descr = task['description']['message'] if task['description'] else task['name']
+                progress.add(task['id'], _("Task #{0}: {1}").format(task['id'], descr))
 
-                if new['state'] == 'FINISHED':
-                    progress.finish()
-                    break
-
-                if new['state'] == 'FAILED':
-                    six.print_()
-                    break
+            # Tasks may have changed before the display was hooked up, so
+            # start from their current state
+            self.progress = progress
+            for tid in tids:
+                task = self.entity_subscribers['task'].items.get(tid)
+                if task:
+                    self.update_progress(task)
 
-                if new['state'] == 'ABORTED':
-                    six.print_()
-                    break
+            progress.wait()
         except KeyboardInterrupt:
-            if progress:
-                progress.end()
+            end_progress()
             six.print_()
             output_msg(_("User requested task termination. Abort signal sent"))
-            self.call_sync('task.abort', tid)
+            for tid in tids:
+                self.call_sync('task.abort', tid)
         except SIGTSTPException:
                 # The User backgrounded the task by sending SIGTSTP (Ctrl+Z)
-                if progress:
-                    progress.end()
+                end_progress()
                 six.print_()
-                output_msg(_("Task {0} will continue to run in the background.".format(tid)))
-                output_msg(_("To bring it back to the foreground execute 'wait {0}'".format(tid)))
+                ids = ', '.join(str(i) for i in tids)
+                output_msg(_("Task {0} will continue to run in the background.".format(ids)))
+                output_msg(_("To bring it back to the foreground execute 'wait {0}'".format(ids.replace(',', ''))))
                 output_msg(_("Use the 'pending' command to see pending tasks (of this session)"))
         finally:
             # Now that we are done with the task unset the Ctrl+Z handler
             # lets set the SIGTSTP (Ctrl+Z) handler
             SIGTSTP_setter(set_flag=False)
-            if progress:
-                progress.end()
-            if generator:
-                del generator
+            end_progress()
 
     def submit_task(self, name, *args, **kwargs):
         callback = kwargs.pop('callback', None)
@@ -994,6 +1286,7 @@ class MainLoop(object):
         'showips': ShowIpsCommand,
         'showurls': ShowUrlsCommand,
         'source': SourceCommand,
+        'compile': CompileCommand,
         'dump': DumpCommand,
         'clear': ClearCommand,
         'history': HistoryCommand,
@@ -1007,6 +1300,7 @@ class MainLoop(object):
         'attach_debugger': AttachDebuggerCommand,
         'w': WCommand,
         'time': TimeCommand,
+        'watch': WatchCommand,
         'remote': RemoteCommand,
         'builtin': BuiltinCommand
     }
@@ -1023,6 +1317,7 @@ class MainLoop(object):
         self.aliases = {}
         self.connection = None
         self.saved_state = None
+        self.completion_cache = CompletionCache()
 
     def __get_prompt(self):
         variables = collections.defaultdict(lambda: '', {
@@ -1179,6 +1474,8 @@ class MainLoop(object):
         for stmt in block:
             try:
                 self.eval(stmt, env=env, first=True)
+                if env is self.context.global_env:
+                    self.context.output_sinks.flush()
             except SystemExit:
                 raise
             except FlowControlInstruction:
@@ -1476,18 +1773,19 @@ class MainLoop(object):
                         return self.eval(item.ast, env=env, path=path)[0]
 
                     if isinstance(item, Command):
-                        completions = item.complete(self.context)
                         token_args = convert_to_literals(token.args)
                         if len(token_args) > 0 and token_args[0] == '..':
                             args = [token_args[0]]
                             kwargs = None
                             opargs = None
                         else:
-                            args, kwargs, opargs = expand_wildcards(
-                                self.context,
-                                *sort_args([self.eval(i, env=env) for i in token_args]),
-                                completions=completions
-                            )
+                            args, kwargs, opargs = sort_args([self.eval(i, env=env) for i in token_args])
+                            # Completers are only needed to expand patterns
+                            if any(has_wildcards(i) for i in itertools.chain(args, kwargs.values())):
+                                args, kwargs, opargs = expand_wildcards(
+                                    self.context, args, kwargs, opargs,
+                                    completions=item.completions(self.context)
+                                )
 
                         item.exec_path = path if len(path) >= 1 else self.path
                         item.cwd = self.cwd
@@ -1506,7 +1804,7 @@ class MainLoop(object):
                                         serialize_filter['filter'] += ret['filter']
 
                                     if 'params' in ret:
-                                        serialize_filter['params'].update(ret['params'])
+                                        merge_filter_params(serialize_filter['params'], ret['params'])
 
                             return item.run(self.context, args, kwargs, opargs, input=input_data)
                         else:
@@ -1587,8 +1885,9 @@ class MainLoop(object):
                 return token
 
             if isinstance(token, Redirection):
-                with open(token.path, 'a+') as f:
-                    format_output(self.eval(token.body, env=env, path=path, first=first), file=f)
+                result = self.eval(token.body, env=env, path=path, first=first)
+                with self.context.output_sinks.acquire(token.path) as f:
+                    format_output(result, file=f)
                     return None
 
         except SystemExit as err:
@@ -1635,30 +1934,34 @@ class MainLoop(object):
 
             for i in tokens:
                 try:
-                    self.context.call_stack = []
-                    ret = self.eval(i, first=True, printable_none=True)
-                except SystemExit as err:
-                    raise err
-                except BaseException as err:
-                    output_msg('Error: {0}'.format(str(err)))
-                    if len(self.context.call_stack) > 1:
-                        output_msg('Call stack: ')
-                        for i in self.context.call_stack:
-                            output_msg('  ' + str(i))
+                    try:
+                        self.context.call_stack = []
+                        ret = self.eval(i, first=True, printable_none=True)
+                    except SystemExit as err:
+                        raise err
+                    except BaseException as err:
+                        output_msg('Error: {0}'.format(str(err)))
+                        if len(self.context.call_stack) > 1:
+                            output_msg('Call stack: ')
+                            for i in self.context.call_stack:
+                                output_msg('  ' + str(i))
 
-                    if self.context.variables.get('debug'):
-                        output_msg('Python call stack: ')
-                        output_msg(traceback.format_exc())
+                        if self.context.variables.get('debug'):
+                            output_msg('Python call stack: ')
+                            output_msg(traceback.format_exc())
 
-                    return
+                        return
 
-                if ret is not None:
-                    output = self.context.variables.get('output')
-                    if output:
-                        with open(output, 'a+') as f:
-                            format_output(ret, file=f)
-                    else:
-                        format_output(ret)
+                    if ret is not None:
+                        output = self.context.variables.get('output')
+                        if output:
+                            with self.context.output_sinks.acquire(output) as f:
+                                format_output(ret, file=f)
+                        else:
+                            format_output(ret)
+                finally:
+                    # Whatever a statement redirected is on disk once it completes
+                    self.context.output_sinks.flush()
         except SyntaxError as e:
             output_msg(_('Syntax error: {0}'.format(str(e))))
             return 1
@@ -1694,6 +1997,15 @@ class MainLoop(object):
         return 0
 
     def get_relative_object(self, ns, tokens):
+        return self.resolve_relative_object(ns, tokens)[0]
+
+    def resolve_relative_object(self, ns, tokens):
+        """
+        Walks ``tokens`` from ``ns`` like get_relative_object() and returns
+        the object found, the namespaces leading to it and, for commands,
+        the name the command was found by. ``tokens`` is consumed up to the
+        object found.
+        """
         path = self.path[:]
         ptr = ns
         first_len = len(tokens) - 1
@@ -1709,6 +2021,7 @@ class MainLoop(object):
                 name = token
 
             if name == '/' and len(tokens) == first_len:
+                path = path[:1]
                 ptr = path[0]
             if name == '..' and len(path) > 1:
                 del path[-1]
@@ -1725,15 +2038,15 @@ class MainLoop(object):
 
                 cmds = ptr.commands()
                 if name in cmds:
-                    return cmds[name]
+                    return cmds[name], path, name
 
                 if name in self.builtin_commands:
                     cmd = self.builtin_commands[name]()
                     cmd.variables = self.context.variables
                     cmd.env = {}
-                    return cmd
+                    return cmd, path, name
 
-        return ptr
+        return ptr, path, None
 
     def complete(self, text, state):
         if state == 0:
@@ -1774,12 +2087,18 @@ class MainLoop(object):
                         args = token.args
 
                 if isinstance(token, CommandCall) or not args:
-                    obj = self.get_relative_object(self.cwd, args)
+                    obj, obj_path, obj_name = self.resolve_relative_object(self.cwd, args)
                 else:
                     return None
 
                 if issubclass(type(obj), Namespace):
-                    choices = [quote(i.get_name()) for i in obj.namespaces()]
+                    if isinstance(obj, EntityNamespace):
+                        choices = [quote(i) for i in obj.complete_names(text.lstrip('"'))]
+                        with obj.static_namespaces():
+                            choices += [quote(i.get_name()) for i in obj.namespaces()]
+                    else:
+                        choices = [quote(i.get_name()) for i in obj.namespaces()]
+
                     choices += obj.commands().keys()
                     choices += ['..', '/', '-']
 
@@ -1803,26 +2122,29 @@ class MainLoop(object):
                         if len(token_args) > 0 and token_args[0] == '..':
                             args = [token_args[0]]
                         else:
-                            c_args, c_kwargs, c_opargs = expand_wildcards(
-                                self.context,
-                                *sort_args([self.eval(i) for i in token_args]),
-                                completions=obj.complete(self.context, text=text)
-                            )
+                            c_args, c_kwargs, c_opargs = sort_args([self.eval(i) for i in token_args])
+                            if any(has_wildcards(i) for i in itertools.chain(c_args, c_kwargs.values())):
+                                c_args, c_kwargs, c_opargs = expand_wildcards(
+                                    self.context, c_args, c_kwargs, c_opargs,
+                                    completions=obj.completions(self.context)
+                                )
 
                     completions = obj.complete(self.context, text=text, args=c_args, kwargs=c_kwargs, opargs=c_opargs)
                     choices = [c.name for c in completions if isinstance(c.name, six.string_types)]
 
                     arg = find_arg(args, readline.get_begidx())
+                    key = (tuple(str(i.get_name()) for i in obj_path), obj_name)
+
                     if arg is False:
                         return None
                     elif isinstance(arg, six.integer_types):
                         completion = first_or_default(lambda c: c.name == arg, completions)
                         if completion:
-                            choices = completion.choices(self.context, None)
+                            choices = self.completion_cache.complete(key + (arg,), completion, self.context, None, text)
                     elif isinstance(arg, BinaryParameter):
                         completion = first_or_default(lambda c: c.name == arg.left + '=', completions)
                         if completion:
-                            choices = completion.choices(self.context, arg)
+                            choices = self.completion_cache.complete(key + (completion.name,), completion, self.context, arg, text)
                     else:
                         raise AssertionError('Unknown arg returned by find_arg()')
                 else:
@@ -2017,14 +2339,14 @@ def main(argv=None):
     for path in cli_rc_paths:
         if os.path.isfile(path):
             try:
-                with open(path, 'r') as f:
-                    ast = parse(f.read(), path)
-                    context.eval_block(ast)
+                ast = parse_file(path)
             except UnicodeDecodeError as e:
                 raise CommandException(_(
                     "Incorrect filetype, cannot parse clirc file: {0}".format(str(e))
                 ))
 
+            context.eval_block(ast)
+
     ml.repl()
 
 
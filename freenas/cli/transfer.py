@@ -0,0 +1,284 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import bz2
+import lzma
+import zlib
+import time
+import gettext
+import hashlib
+import tempfile
+import threading
+from freenas.dispatcher.fd import FileDescriptor
+from freenas.cli.namespace import CommandException
+from freenas.cli.output import ProgressDisplay, ValueType, format_value
+from freenas.utils import query as q
+
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+TRANSFER_PROGRESS_INTERVAL = 0.5
+TRANSFER_PROGRESS_INTERVAL_NOTTY = 5
+COMPRESSORS = {
+    'gzip': lambda: zlib.compressobj(9, zlib.DEFLATED, 31),
+    'xz': lambda: lzma.LZMACompressor(),
+    'bz2': lambda: bz2.BZ2Compressor()
+}
+DECOMPRESSORS = {
+    'gzip': (b'\x1f\x8b', lambda: zlib.decompressobj(31)),
+    'xz': (b'\xfd7zXZ\x00', lambda: lzma.LZMADecompressor()),
+    'bz2': (b'BZh', lambda: bz2.BZ2Decompressor())
+}
+
+
+class Transfer(object):
+    """
+    Streams data between a local file and a task through a pipe, reporting
+    bytes, rate and ETA through a ProgressDisplay and computing the SHA-256
+    of the data as seen by the server (i.e. before compression on download
+    and after decompression on upload).
+    """
+    def __init__(self, label, total=None):
+        self.label = label
+        self.total = total
+        self.transferred = 0
+        self.sha256 = hashlib.sha256()
+        self.error = None
+        self.started_at = time.monotonic()
+        self.reported_at = 0
+        self.progress = ProgressDisplay()
+        self.interval = TRANSFER_PROGRESS_INTERVAL if self.progress.tty else TRANSFER_PROGRESS_INTERVAL_NOTTY
+        self.progress.add(label, label)
+
+    def report(self, state=None):
+        now = time.monotonic()
+        if not state and now - self.reported_at < self.interval:
+            return
+
+        self.reported_at = now
+        elapsed = now - self.started_at
+        rate = self.transferred / elapsed if elapsed > 0 else 0
+        message = '{0} {1}/s'.format(
+            format_value(self.transferred, ValueType.SIZE),
+            format_value(int(rate), ValueType.SIZE)
+        )
+
+        percentage = None
+        if self.total:
+            percentage = min(self.transferred / self.total * 100, 100)
+
+        self.progress.update(self.label, percentage, message, state)
+
+    def pump(self, source, sink):
+        try:
+            while True:
+                data = source()
+                if not data:
+                    break
+
+                sink(data)
+                self.report()
+        except BaseException as err:
+            self.error = err
+
+    def run(self, context, name, args, worker, reading):
+        """
+        Runs task ``name`` with ``args`` while ``worker`` moves the data in a
+        separate thread, and returns the task. The worker gets the read end
+        of a pipe if ``reading`` is set and the write end otherwise; the
+        task gets the other end in place of None in ``args``.
+        """
+        rfd, wfd = os.pipe()
+        pipe_local, pipe_remote = (rfd, wfd) if reading else (wfd, rfd)
+        thread = threading.Thread(target=worker, args=(pipe_local,))
+        thread.daemon = True
+        thread.start()
+        try:
+            args = [FileDescriptor(fd=pipe_remote, close=False) if a is None else a for a in args]
+            result = context.call_task_sync(name, *args)
+        except BaseException:
+            # The worker ends once the task lets go of the pipe
+            os.close(pipe_remote)
+            self.report('FAILED')
+            self.progress.end()
+            raise
+
+        # Our copy of the task's end would keep the pipe open forever
+        os.close(pipe_remote)
+        thread.join()
+
+        # The final state has to be drawn before the display ends
+        if result['state'] != 'FINISHED':
+            self.report('FAILED')
+            self.progress.end()
+            raise CommandException(_('{0} failed: {1}'.format(self.label, q.get(result, 'error.message'))))
+
+        if self.error:
+            self.report('FAILED')
+            self.progress.end()
+            raise CommandException(_('{0} failed: {1}'.format(self.label, self.error)))
+
+        self.report('FINISHED')
+        self.progress.end()
+        return result
+
+    def verify(self, result):
+        """
+        Compares the checksum against the ``sha256`` the task returned,
+        which only servers whose dump tasks report one provide.
+        """
+        digest = q.get(result, 'result.sha256')
+        if not digest:
+            raise CommandException(_('Server did not report a checksum to verify against'))
+
+        if digest != self.sha256.hexdigest():
+            raise CommandException(_('Checksum mismatch: server reported {0}, received data has {1}'.format(
+                digest, self.sha256.hexdigest()
+            )))
+
+
+def download(context, label, name, args, path, compress=None, verify=False):
+    """
+    Saves the data task ``name`` writes to the file descriptor passed in
+    place of None in ``args`` to ``path``, optionally compressed. The data
+    goes to a temporary file next to ``path``, which replaces ``path`` only
+    once the task succeeded (and the checksum matched when verifying, see
+    Transfer.verify). Returns the SHA-256 of the data.
+    """
+    if compress and compress not in COMPRESSORS:
+        raise CommandException(_('Unknown compression {0}, use one of: {1}'.format(
+            compress, ', '.join(COMPRESSORS)
+        )))
+
+    path = os.path.abspath(path)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.{0}.'.format(os.path.basename(path)))
+    except OSError as err:
+        raise CommandException(_('Cannot write {0}: {1}'.format(path, err.strerror)))
+
+    transfer = Transfer(label)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            compressor = COMPRESSORS[compress]() if compress else None
+
+            def receive(rfd):
+                def source():
+                    return os.read(rfd, TRANSFER_CHUNK_SIZE)
+
+                def sink(data):
+                    transfer.sha256.update(data)
+                    transfer.transferred += len(data)
+                    f.write(compressor.compress(data) if compressor else data)
+
+                try:
+                    transfer.pump(source, sink)
+                    if compressor:
+                        f.write(compressor.flush())
+                finally:
+                    os.close(rfd)
+
+            result = transfer.run(context, name, args, receive, True)
+            if verify:
+                transfer.verify(result)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+        raise
+
+    return transfer.sha256.hexdigest()
+
+
+def upload(context, label, name, args, path, decompress=None):
+    """
+    Feeds ``path`` to task ``name`` through the file descriptor passed in
+    place of None in ``args``, decompressing it on the fly if ``decompress``
+    names the compression it was saved with. Files are sent as they are
+    otherwise, whatever they look like. Returns the SHA-256 of the data
+    sent.
+    """
+    if decompress and decompress not in DECOMPRESSORS:
+        raise CommandException(_('Unknown compression {0}, use one of: {1}'.format(
+            decompress, ', '.join(DECOMPRESSORS)
+        )))
+
+    try:
+        f = open(path, 'rb')
+    except OSError as err:
+        raise CommandException(_('Cannot open {0}: {1}'.format(path, err.strerror)))
+
+    with f:
+        decompressor = None
+        if decompress:
+            magic, factory = DECOMPRESSORS[decompress]
+            if f.read(len(magic)) != magic:
+                raise CommandException(_('{0} is not compressed with {1}'.format(path, decompress)))
+
+            f.seek(0)
+            decompressor = factory()
+
+        transfer = Transfer(label, None if decompressor else os.fstat(f.fileno()).st_size)
+
+        def send(wfd):
+            def source():
+                while True:
+                    data = f.read(TRANSFER_CHUNK_SIZE)
+                    if not decompressor or not data:
+                        return data
+
+                    # A chunk may only complete a compressed block; read on
+                    # until there is output so that b'' still means EOF
+                    data = decompressor.decompress(data)
+                    if data:
+                        return data
+
+            def sink(data):
+                transfer.sha256.update(data)
+                transfer.transferred += len(data)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(wfd, view):]
+
+            try:
+                transfer.pump(source, sink)
+            finally:
+                # EOF for the task
+                os.close(wfd)
+
+        transfer.run(context, name, args, send, False)
+
+    return transfer.sha256.hexdigest()
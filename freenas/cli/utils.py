@@ -32,14 +32,19 @@ import tempfile
 import ipaddress
 import gettext
 import signal
+import operator
+import threading
+import concurrent.futures
 import dateutil.tz
-from freenas.utils.query import get, set
+from freenas.utils.query import get, set, query
 from datetime import timedelta, datetime
 
 
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
+FANOUT_WORKERS = 8
+
 try:
     from bsd import pty
 except ImportError:
@@ -282,6 +287,57 @@ def get_filtered(context, field, subscriber, *filters):
     return context.entity_subscribers[subscriber].query(*filters, select=field)
 
 
+FILTER_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    'in': lambda x, y: x in y,
+    'nin': lambda x, y: x not in y
+}
+
+
+def compile_filter(params):
+    """
+    Turns query filter terms into a single predicate, so that matching
+    each of many objects (e.g. incoming events) doesn't interpret the
+    terms again. Operators without a compiled form fall back to a query.
+    """
+    def compile_term(term):
+        if len(term) == 2:
+            op, terms = term
+            preds = [compile_term(i) for i in terms]
+            if op == 'or':
+                return lambda obj: any(p(obj) for p in preds)
+
+            if op == 'nor':
+                return lambda obj: not any(p(obj) for p in preds)
+
+            return lambda obj: all(p(obj) for p in preds)
+
+        key, op, value = term
+        if op == '~':
+            regex = re.compile(value)
+            return lambda obj: get(obj, key) is not None and regex.search(str(get(obj, key))) is not None
+
+        fn = FILTER_OPERATORS.get(op)
+        if not fn:
+            return lambda obj: query([obj], term, single=True) is not None
+
+        def match(obj):
+            try:
+                return fn(get(obj, key), value)
+            except TypeError:
+                return False
+
+        return match
+
+    preds = [compile_term(i) for i in params]
+    return lambda obj: all(p(obj) for p in preds)
+
+
 def add_tty_formatting(context, input):
     set_bold_font = '\033[1m'
     reset_font = '\033[0m'
@@ -392,3 +448,35 @@ class EntityPromise(TaskPromise):
         self.result = super(EntityPromise, self).wait()
         self.ns.wait()
         return self.ns
+
+
+class FanOut(object):
+    """
+    Runs the independent RPCs and namespace loads of one composite command
+    concurrently on a bounded thread pool. Identical calls made through
+    call() are only issued once. Both call() and submit() return futures;
+    their result() re-raises whatever the call raised.
+    """
+    def __init__(self, context, workers=FANOUT_WORKERS):
+        self.context = context
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.executor.shutdown(wait=True)
+
+    def call(self, name, *args):
+        key = (name, repr(args))
+        with self.lock:
+            future = self.calls.get(key)
+            if not future:
+                future = self.calls[key] = self.executor.submit(self.context.call_sync, name, *args)
+
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
@@ -0,0 +1,96 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+"""
+Throughput benchmarks for the ascii output formatter. Not collected by
+pytest; run as ``python tests/benchmark_ascii.py [rows]``.
+"""
+
+import io
+import sys
+import time
+from freenas.cli.output import Table
+from freenas.cli.output.ascii import AsciiOutputFormatter, FORMAT_TABLE_SAMPLE_SIZE
+
+
+DEFAULT_ROWS = 50000
+COLUMNS = [
+    Table.Column('Name', 'name'),
+    Table.Column('Description', 'desc'),
+    Table.Column('Size', 'size')
+]
+
+
+def rows(count):
+    for i in range(count):
+        yield {
+            'name': 'item{0}'.format(i),
+            'desc': 'some quite long description text that wraps around the column ' * (i % 3),
+            'size': i
+        }
+
+
+def measure(name, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print('{0}: {1} rows in {2:.3f}s, {3:.0f} rows/s'.format(name, count, elapsed, count / elapsed))
+
+
+def bench_stream_table(count):
+    measure('streamed table', count, lambda: AsciiOutputFormatter._print_stream_table(
+        Table(rows(count), COLUMNS), io.StringIO(), '\n'
+    ))
+
+
+def bench_table(count):
+    measure('table', count, lambda: AsciiOutputFormatter._print_table(
+        Table(rows(count), COLUMNS), io.StringIO(), '\n'
+    ))
+
+
+def bench_widths(count):
+    # What sizing the columns costs with the sample the table printer uses,
+    # compared to formatting every row up front
+    sample = min(count, FORMAT_TABLE_SAMPLE_SIZE)
+    measure('widths from sample', sample, lambda: AsciiOutputFormatter.compute_widths(
+        COLUMNS, AsciiOutputFormatter.format_rows(COLUMNS, rows(sample))
+    ))
+    measure('widths from all rows', count, lambda: AsciiOutputFormatter.compute_widths(
+        COLUMNS, AsciiOutputFormatter.format_rows(COLUMNS, rows(count))
+    ))
+
+
+def main(argv):
+    count = int(argv[0]) if argv else DEFAULT_ROWS
+    bench_stream_table(count)
+    bench_table(count)
+    bench_widths(count)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
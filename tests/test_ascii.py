@@ -0,0 +1,86 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import random
+import pytest
+
+pytest.importorskip('freenas.utils')
+
+from freenas.cli.output.ascii import AsciiStreamTablePrinter
+
+
+def reference_wrap(element, width):
+    # Cell splitting of the table printer before it was buffered,
+    # reduced to a single column
+    lines = [element]
+    idx = 0
+    while idx < len(lines):
+        elem = lines[idx]
+        if len(elem) >= width:
+            words = elem.split()
+            if len(words) > 1 and len(words[0]) < width:
+                current = words.pop(0)
+                rest = ''
+                for i, word in enumerate(words):
+                    if len(current + ' ' + word) < width:
+                        current += ' ' + word
+                    else:
+                        rest += ' '.join(words[i:])
+                        break
+            else:
+                current, rest = elem[:width], elem[width:]
+
+            lines[idx] = current
+            if idx + 1 < len(lines):
+                lines[idx + 1] = rest
+            else:
+                lines.append(rest)
+
+        idx += 1
+
+    return lines
+
+
+@pytest.mark.parametrize('element,width', [
+    ('abcde', 5),
+    ('ab de', 5),
+    ('a  b', 4),
+    ('abcd', 5),
+    ('', 3),
+    ('averyveryverylongword and more', 6),
+])
+def test_wrap_boundaries(element, width):
+    assert AsciiStreamTablePrinter._wrap(element, width) == reference_wrap(element, width)
+
+
+def test_wrap_matches_reference():
+    rnd = random.Random(0)
+    alphabet = 'ab  c'
+    for i in range(5000):
+        element = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40)))
+        width = rnd.randint(1, 12)
+        assert AsciiStreamTablePrinter._wrap(element, width) == reference_wrap(element, width), (element, width)
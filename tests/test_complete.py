@@ -0,0 +1,109 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import pytest
+
+pytest.importorskip('freenas.utils')
+
+from freenas.cli.complete import CompletionCache, EntitySubscriberComplete, RpcComplete
+
+
+NETWORKS = [
+    {'id': 'n1', 'name': 'front', 'host': 'h0'},
+    {'id': 'n2', 'name': 'back', 'host': 'h0'},
+    {'id': 'n3', 'name': 'bridge', 'host': 'h1'},
+]
+
+
+class FakeSubscriber(object):
+    def __init__(self, items):
+        self.items = items
+        self.on_add = set()
+        self.on_update = set()
+        self.on_delete = set()
+
+    def wait_ready(self):
+        pass
+
+    def query(self, *filter, callback=None):
+        result = [i for i in self.items if all(i[k] == v for k, op, v in filter)]
+        return [callback(i) for i in result] if callback else result
+
+
+class FakeContext(object):
+    def __init__(self):
+        self.entity_subscribers = {'docker.network': FakeSubscriber(NETWORKS)}
+        self.calls = []
+
+    def call_sync(self, name, *args):
+        self.calls.append(args)
+        return [{'name': '{0}-{1}'.format(name, a)} for a in args]
+
+
+def networks(host):
+    # What DockerContainerCreate.complete builds for a given host= argument
+    return EntitySubscriberComplete(
+        name='networks=',
+        datasource='docker.network',
+        mapper=lambda i: i['name'],
+        filter=[('host', '=', host)]
+    )
+
+
+def test_filter_is_part_of_key():
+    cache = CompletionCache()
+    context = FakeContext()
+    key = (('docker', 'container'), 'create', 'networks=')
+    assert cache.complete(key, networks('h0'), context, None, '') == ['back', 'front']
+    assert cache.complete(key, networks('h1'), context, None, '') == ['bridge']
+    assert cache.complete(key, networks('h0'), context, None, 'f') == ['front']
+
+
+def test_mapper_closure_is_part_of_key():
+    cache = CompletionCache()
+    context = FakeContext()
+    key = (('docker', 'container'), 'create', 'networks=')
+
+    def completer(field):
+        return EntitySubscriberComplete('networks=', 'docker.network', lambda i: i[field])
+
+    assert cache.complete(key, completer('name'), context, None, '') == ['back', 'bridge', 'front']
+    assert cache.complete(key, completer('id'), context, None, '') == ['n1', 'n2', 'n3']
+
+
+def test_call_args_are_part_of_key():
+    cache = CompletionCache()
+    context = FakeContext()
+    key = (('vm',), 'import', 'image=')
+
+    def completer(arg):
+        return RpcComplete('image=', 'vm.images', lambda o: o['name'], call_args=[arg])
+
+    assert cache.complete(key, completer('a'), context, None, '') == ['vm.images-a']
+    assert cache.complete(key, completer('b'), context, None, '') == ['vm.images-b']
+    assert cache.complete(key, completer('a'), context, None, '') == ['vm.images-a']
+    assert context.calls == [('a',), ('b',)]
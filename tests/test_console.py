@@ -0,0 +1,264 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import sys
+import time
+import random
+import threading
+import types
+import pytest
+
+pytest.importorskip('freenas.dispatcher.shell')
+
+from freenas.cli import console
+
+
+THROUGHPUT_PAYLOAD_SIZE = 32 * 1024 * 1024
+MIN_THROUGHPUT = 4 * 1024 * 1024
+
+
+def make_console(sequence='~~.'):
+    context = types.SimpleNamespace(variables={'vm.console_interrupt': sequence})
+    return console.Console(context, 'test')
+
+
+def scan_chunks(con, chunks):
+    out = b''
+    for chunk in chunks:
+        data, escaped = con.scan(chunk)
+        out += data
+        if escaped:
+            return out, True
+
+    return out, False
+
+
+class FakeConsoleServer(object):
+    """
+    Stands in for the console connection: streams ``payload`` to the
+    console in chunks of random size from its own thread, then closes.
+    """
+    def __init__(self, payload, max_chunk=console.READ_CHUNK_SIZE):
+        self.payload = payload
+        self.max_chunk = max_chunk
+        self.input = bytearray()
+        self.thread = None
+
+    def open(self, context, id, on_data, on_close):
+        def serve():
+            rnd = random.Random(0)
+            view = memoryview(self.payload)
+            while view:
+                size = rnd.randint(1, self.max_chunk)
+                on_data(bytes(view[:size]))
+                view = view[size:]
+
+            on_close()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, text):
+        self.input += text.encode('utf-8')
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('chunks,expected', [
+    ([b'ab~~.cd'], (b'ab', True)),
+    ([b'ab~', b'~.'], (b'ab', True)),
+    ([b'ab~', b'~', b'.'], (b'ab', True)),
+    ([b'x~~', b'y'], (b'x~~y', False)),
+    ([b'~~~.'], (b'~', True)),
+    ([b'~', b'~', b'~', b'.'], (b'~', True)),
+    ([b'~.~~'], (b'~.', False)),
+    ([b'plain text'], (b'plain text', False)),
+])
+def test_scan(chunks, expected):
+    assert scan_chunks(make_console(), chunks) == expected
+
+
+def test_scan_holds_back_partial_sequence():
+    con = make_console()
+    assert con.scan(b'abc~~') == (b'abc', False)
+    assert con.scan(b'x') == (b'~~x', False)
+
+
+@pytest.mark.parametrize('sequence', ['~~.', 'aab', 'abab', '\\x1d'])
+def test_scan_matches_search(sequence):
+    rnd = random.Random(sequence)
+    esbytes = sequence.encode('utf-8').decode('unicode_escape').encode('utf-8')
+    alphabet = sorted(set(esbytes)) + [ord('z')]
+    for i in range(2000):
+        data = bytes(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30)))
+        cuts = sorted(rnd.sample(range(len(data) + 1), min(3, len(data) + 1)))
+        chunks = [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+        con = make_console(sequence)
+        out, escaped = scan_chunks(con, chunks)
+        idx = data.find(esbytes)
+        if idx >= 0:
+            assert (out, escaped) == (data[:idx], True), (data, chunks)
+        else:
+            # Whatever could still start the sequence is held back
+            assert (out + esbytes[:con.esidx], escaped) == (data, False), (data, chunks)
+
+
+def test_scan_throughput():
+    con = make_console()
+    data = os.urandom(THROUGHPUT_PAYLOAD_SIZE).replace(b'~', b'-')
+    start = time.perf_counter()
+    for i in range(0, len(data), console.READ_CHUNK_SIZE):
+        con.scan(data[i:i + console.READ_CHUNK_SIZE])
+
+    assert len(data) / (time.perf_counter() - start) > MIN_THROUGHPUT
+
+
+def test_output_throughput(monkeypatch):
+    payload = os.urandom(THROUGHPUT_PAYLOAD_SIZE)
+    server = FakeConsoleServer(payload)
+    monkeypatch.setattr(console, 'open_console', server.open)
+    rfd, wfd = os.pipe()
+    monkeypatch.setattr(sys, 'stdout', types.SimpleNamespace(fileno=lambda: wfd))
+    received = bytearray()
+
+    def drain():
+        while True:
+            data = os.read(rfd, console.READ_CHUNK_SIZE)
+            if not data:
+                return
+
+            received.extend(data)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    con = make_console()
+    writer = threading.Thread(target=con.writer, daemon=True)
+    start = time.perf_counter()
+    writer.start()
+    con.connect()
+    server.thread.join()
+    with con.output_cv:
+        con.closed = True
+        con.output_cv.notify()
+
+    writer.join()
+    os.close(wfd)
+    reader.join()
+    elapsed = time.perf_counter() - start
+    os.close(rfd)
+    os.close(con.eof_r)
+    os.close(con.eof_w)
+
+    assert received == payload
+    assert len(payload) / elapsed > MIN_THROUGHPUT
+
+
+class IdleConsoleServer(object):
+    """
+    Console connection that only sends what the test pushes through it.
+    """
+    def open(self, context, id, on_data, on_close):
+        self.on_data = on_data
+        self.on_close = on_close
+        return self
+
+    def close(self):
+        pass
+
+
+def test_capture_flushes_when_idle(monkeypatch, tmp_path):
+    server = IdleConsoleServer()
+    monkeypatch.setattr(console, 'open_console', server.open)
+    monkeypatch.setattr(console, 'CAPTURE_FLUSH_INTERVAL', 0.05)
+    path = tmp_path / 'console.log'
+    capture = console.ConsoleCapture(None, 'idle', 'idle', str(path))
+    assert capture.start()
+    try:
+        server.on_data(b'login: ')
+        deadline = time.monotonic() + 5
+        while path.read_bytes() != b'login: ' and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert path.read_bytes() == b'login: '
+    finally:
+        capture.stop()
+
+
+def test_capture_follow_flushes_every_write(monkeypatch):
+    class Stdout(object):
+        def __init__(self):
+            self.data = bytearray()
+            self.flushed = bytearray()
+
+        def write(self, data):
+            self.data += data
+
+        def flush(self):
+            self.flushed[:] = self.data
+
+    stdout = Stdout()
+    server = IdleConsoleServer()
+    monkeypatch.setattr(console, 'open_console', server.open)
+    monkeypatch.setattr(sys, 'stdout', types.SimpleNamespace(buffer=stdout))
+    capture = console.ConsoleCapture(None, 'follow', 'follow')
+    assert capture.start()
+    try:
+        for i in (b'one ', b'two'):
+            server.on_data(i)
+            assert stdout.flushed == stdout.data
+    finally:
+        capture.stop()
+
+    assert stdout.data == b'one two'
+
+
+def test_capture_start_failure_unregisters(tmp_path):
+    capture = console.ConsoleCapture(None, 'broken', 'broken', str(tmp_path / 'missing' / 'console.log'))
+    with pytest.raises(OSError):
+        capture.start()
+
+    assert console.ConsoleCapture.get('broken') is None
+    assert capture.closed.is_set()
+
+
+@pytest.mark.parametrize('keep', [0, 2])
+def test_capture_rotation(monkeypatch, tmp_path, keep):
+    payload = os.urandom(64 * 1024)
+    server = FakeConsoleServer(payload, max_chunk=1024)
+    monkeypatch.setattr(console, 'open_console', server.open)
+    path = tmp_path / 'console.log'
+    capture = console.ConsoleCapture(None, 'rotate', 'rotate', str(path), rotate=8 * 1024, keep=keep)
+    assert capture.start()
+    capture.wait()
+
+    rotated = sorted(i.name for i in tmp_path.iterdir())
+    assert rotated == ['console.log'] + ['console.log.{0}'.format(i) for i in range(1, keep + 1)]
+    assert len(path.read_bytes()) < 8 * 1024
+    assert payload.endswith(path.read_bytes())
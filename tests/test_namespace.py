@@ -0,0 +1,77 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import pytest
+
+pytest.importorskip('freenas.utils')
+pytest.importorskip('freenas.dispatcher')
+
+from freenas.utils import query as q
+from freenas.cli.namespace import BaseListCommand, unproject
+from freenas.cli.plugins.log import LogNamespace
+from freenas.cli.plugins.tasks import TasksNamespace
+from freenas.cli.plugins.volumes import SnapshotsNamespace
+
+
+class FakeContext(object):
+    pass
+
+
+def sample_entity(fields):
+    # Every selected field gets a distinct value, next to fields that
+    # projection leaves out
+    entity = {'unlisted': 'x', 'nested': {'unlisted': 'y'}}
+    for idx, path in enumerate(fields):
+        ptr = entity
+        *parents, key = path.split('.')
+        for i in parents:
+            ptr = ptr.setdefault(i, {})
+
+        ptr[key] = 'value{0}'.format(idx)
+
+    return entity
+
+
+@pytest.mark.parametrize('cls', [LogNamespace, TasksNamespace, SnapshotsNamespace])
+def test_unproject_keeps_listed_columns(cls):
+    ns = cls('test', FakeContext())
+    assert ns.large and ns.projection
+
+    mappings = [col for col in ns.property_mappings if col.list]
+    fields = BaseListCommand(ns)._BaseListCommand__projection(mappings)
+    if fields is None:
+        # Computed columns make show fetch entities whole
+        return
+
+    entity = sample_entity(fields)
+    rows = [[q.get(entity, f) for f in fields]]
+    projected, = unproject(rows, fields)
+    for col in mappings:
+        assert col.do_get(projected) == col.do_get(entity), col.name
+
+    if ns.primary_key:
+        assert ns.primary_key.do_get(projected) == ns.primary_key.do_get(entity)
@@ -0,0 +1,62 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import io
+import pytest
+
+pytest.importorskip('freenas.utils')
+
+import freenas.cli.output
+from freenas.cli.output import format_output, output_list, output_less
+
+
+FORMATS = ['ascii', 'json', 'ndjson', 'csv', 'tsv']
+ITEMS = ['alpha', 'beta', 'gamma']
+MAPPING = {'alpha': 'one', 'beta': 'two'}
+
+
+def emit(fmt, file):
+    output_list(ITEMS, fmt=fmt, file=file)
+    format_output(MAPPING, fmt=fmt, file=file)
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_list_and_dict_follow_file(fmt, capsys):
+    sink = io.StringIO()
+    emit(fmt, sink)
+    assert capsys.readouterr().out == ''
+    for i in ITEMS + list(MAPPING.values()):
+        assert i in sink.getvalue()
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_list_and_dict_through_pager(fmt, monkeypatch, capfd):
+    monkeypatch.setattr(freenas.cli.output, 'get_pager', lambda: 'cat')
+    direct = io.StringIO()
+    emit(fmt, direct)
+    assert output_less(lambda pipe: emit(fmt, pipe))
+    assert capfd.readouterr().out == direct.getvalue()
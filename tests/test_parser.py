@@ -0,0 +1,144 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import glob
+import random
+import pytest
+
+from freenas.cli import parser
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'freenas', 'cli', 'examples')
+LINES = [
+    'volume tank dataset show', 'account user create foo uid=1000 groups=a,b,c', 'show | search name==root',
+    'show | search name~="ro ot" | sort -name | limit 10', '/account user', '/', '..', '.. ..', '?', 'volume ?',
+    'network interface vlan0 set enabled=yes', 'a,b', 'cmd x=1 y="s p" z=a,b', 'cmd 5', '5 cmd', 'cmd "x" "y\\"z"',
+    'disk ada0 show', 'cmd a=b=c', 'x = 5', 'cmd k=-1', 'cmd k=+1', 'cmd k>=3 k<=4 k>1 k<2 k!=3', 'cmd 10k',
+    'cmd 1.2.3.4', 'cmd dead:beef', 'cmd #comment', 'echo ${x}', 'cmd k=', 'cmd a,', 'cmd | ', 'cmd a.b/c@d+e*f-g',
+    'share smb foo_bar show', 'if (x) { echo }', 'cmd ..,..', 'cmd ?', 'cmd k=?', 'cmd k=..', 'cmd k=a,? x',
+    'cmd >> f', 'cmd true', 'cmd none', '"str" cmd', 'cmd "a""b"', 'cmd a"b"', 'cmd    spaced     out   ',
+    '  leading', 'cmd\tk=v', 'vm foo console', 'cmd 0x10', 'cmd 007', 'cmd 1:30', 'cmd k=1:30', 'cmd in',
+    'cmd info', 'cmd -x', 'cmd x-', 'cmd ..foo', 'cmd éa', 'cmd a é', 'show | search name==root | select name',
+    'cmd k==v', 'cmd k~=v', 'cmd a ,b', 'cmd a , b', 'x|y|z', 'cmd k=a b=c,d e',
+]
+FRAGMENTS = [
+    ':', '#', '5k', '0x1', '"""', '\t', ' if', ' true', 'é', '~', '!', '<', '>>', '=-', '=+', 'ab:cd', '-', '+x',
+    '*', '-5', 'a', 'b', 'x1', ' ', ' ', '=', ',', '|', '"q"', '1', '..', '?', '/', '-', '==', '!=', 'k', '_', '.', '>'
+]
+
+
+def signature(node):
+    # AST nodes do not compare by value; compare their types, fields and positions
+    if isinstance(node, list):
+        return ['list'] + [signature(i) for i in node]
+
+    if isinstance(node, tuple):
+        return tuple(signature(i) for i in node)
+
+    if hasattr(node, 'args_list'):
+        return (
+            type(node).__name__,
+            tuple(signature(getattr(node, i)) for i in node.args_list),
+            tuple(getattr(node, i, None) for i in ('file', 'line', 'column', 'column_end'))
+        )
+
+    return type(node).__name__, node
+
+
+def example_lines():
+    for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '**', '*.cli'), recursive=True)):
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+    with open(os.path.join(EXAMPLES_DIR, 'oneliners'), encoding='utf8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def generated_lines(count=20000, seed=1):
+    rnd = random.Random(seed)
+    for i in range(count):
+        yield ''.join(rnd.choice(FRAGMENTS) for _ in range(rnd.randint(1, 10)))
+
+
+def check(line, recover_errors=False):
+    fast = parser.fast_parse(line, '<test>')
+    if fast is None:
+        return False
+
+    slow = parser.parse_slow(line, '<test>', recover_errors)
+    assert signature(fast) == signature(slow), line
+    return True
+
+
+@pytest.mark.parametrize('line', LINES)
+def test_fast_path_matches_parser(line):
+    check(line)
+
+
+def test_fast_path_matches_parser_on_examples():
+    assert any([check(line) for line in example_lines()])
+
+
+def test_fast_path_matches_parser_on_generated_lines():
+    assert any([check(line) for line in generated_lines()])
+
+
+@pytest.mark.parametrize('line', LINES)
+def test_fast_path_matches_recovering_parser(line):
+    check(line, True)
+
+
+def test_fast_path_is_taken_for_plain_commands():
+    assert parser.fast_parse('volume tank dataset show', '<test>') is not None
+    assert parser.fast_parse('if (x) { echo }', '<test>') is None
+
+
+def test_cached_ast_points_at_the_parsed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(parser, 'AST_CACHE_DIR', str(tmp_path / 'cache'))
+    source = 'echo 1\nif (x) {\n    echo 2\n}\n'
+    paths = []
+    for name in ('a.cli', 'b.cli'):
+        path = tmp_path / name
+        path.write_text(source, encoding='utf8')
+        paths.append(str(path))
+
+    first = parser.parse_file(paths[0])
+    # Same contents, hence the same cache entry
+    second = parser.parse_file(paths[1])
+    assert len(os.listdir(parser.AST_CACHE_DIR)) == 1
+    assert signature(first) == signature(parser.parse(source, paths[0]))
+    assert signature(second) == signature(parser.parse(source, paths[1]))
+
+    # Compiled artifacts follow the script when it is moved
+    target = parser.compile_file(paths[0])
+    moved = tmp_path / 'moved.cli'
+    os.rename(paths[0], str(moved))
+    os.rename(target, str(moved) + parser.AST_CACHE_SUFFIX)
+    assert signature(parser.parse_file(str(moved))) == signature(parser.parse(source, str(moved)))
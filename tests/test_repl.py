@@ -0,0 +1,126 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import sys
+import threading
+import collections
+import pytest
+
+pytest.importorskip('paramiko')
+pytest.importorskip('rollbar')
+pytest.importorskip('freenas.dispatcher.client')
+
+from freenas.cli.repl import HistoryRetention
+
+
+HISTORY_SIZE = 100
+
+
+class FakeVariables(object):
+    def get(self, name):
+        assert name == 'history_size'
+        return HISTORY_SIZE
+
+
+class FakeContext(object):
+    variables = FakeVariables()
+
+
+class FakeSubscriber(object):
+    def __init__(self):
+        self.items = collections.OrderedDict()
+        self.on_add = set()
+
+    def add(self, entity):
+        self.items[entity['id']] = entity
+        for i in self.on_add:
+            i(entity)
+
+    def add_batch(self, entities):
+        # Publishes a new mapping rather than inserting in place, so that
+        # readers only ever race with the trimming
+        items = self.items.copy()
+        items.update((i['id'], i) for i in entities)
+        self.items = items
+        for i in self.on_add:
+            i(entities[-1])
+
+
+def task(id, state='FINISHED'):
+    return {'id': id, 'state': state}
+
+
+def test_trim_keeps_unfinished_tasks():
+    retention = HistoryRetention(FakeContext())
+    subscriber = FakeSubscriber()
+    retention.watch('task', subscriber)
+    subscriber.add(task(0, 'EXECUTING'))
+    for i in range(1, 1000):
+        subscriber.add(task(i))
+
+    assert len(subscriber.items) <= HISTORY_SIZE * (1 + HistoryRetention.SLACK)
+    assert 0 in subscriber.items
+    assert 999 in subscriber.items
+    assert list(subscriber.items) == sorted(subscriber.items)
+    assert retention.is_truncated('task')
+
+
+def test_trim_while_iterating():
+    retention = HistoryRetention(FakeContext())
+    subscriber = FakeSubscriber()
+    retention.watch('syslog', subscriber)
+    done = threading.Event()
+    errors = []
+
+    def iterate():
+        try:
+            while not done.is_set():
+                retention.is_truncated('syslog')
+                for key, entity in subscriber.items.items():
+                    assert entity['id'] == key
+        except Exception as err:
+            errors.append(err)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=iterate) for _ in range(4)]
+    try:
+        for i in readers:
+            i.start()
+
+        for i in range(0, 60000, 50):
+            subscriber.add_batch([task(j) for j in range(i, i + 50)])
+    finally:
+        done.set()
+        for i in readers:
+            i.join()
+
+        sys.setswitchinterval(interval)
+
+    assert not errors
+    assert len(subscriber.items) <= HISTORY_SIZE * (1 + HistoryRetention.SLACK)
+    assert all(i in subscriber.items for i in range(60000 - HISTORY_SIZE, 60000))
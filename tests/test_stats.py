@@ -0,0 +1,73 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import pytest
+
+pytest.importorskip('freenas.utils')
+
+from freenas.cli.parser import parse, BinaryParameter
+from freenas.cli.namespace import CommandException
+from freenas.cli.plugins.stats import parse_duration
+
+
+def durations(line):
+    args = parse(line, '<test>')[0].args
+    return {a.left: parse_duration(a.right.value) for a in args if isinstance(a, BinaryParameter)}
+
+
+@pytest.mark.parametrize('line,expected', [
+    ('history timespan="6h" resolution="5m"', {'timespan': 21600, 'resolution': 300}),
+    ('history timespan="10m" resolution="30s"', {'timespan': 600, 'resolution': 30}),
+    ('history timespan="1d" resolution="90"', {'timespan': 86400, 'resolution': 90}),
+    ('history timespan="15m" resolution="1h"', {'timespan': 900, 'resolution': 3600}),
+])
+def test_parsed_durations(line, expected):
+    assert durations(line) == expected
+
+
+@pytest.mark.parametrize('line', [
+    'history timespan="5x"',
+    'history timespan="2w"',
+    'history timespan="1.5h"',
+    'history timespan="0"',
+    'history timespan="0m"',
+    'history timespan=""',
+    'history timespan=true',
+    # Unquoted, these reach the command as seconds, bytes and plain numbers
+    'history timespan=6h',
+    'history timespan=5m',
+    'history timespan=90',
+])
+def test_invalid_durations(line):
+    with pytest.raises(CommandException):
+        durations(line)
+
+
+def test_unquoted_seconds_are_not_a_duration():
+    # 30s lexes as the number 30 followed by the word s
+    args = parse('history timespan=30s', '<test>')[0].args
+    assert len([a for a in args if not isinstance(a, BinaryParameter)]) == 2
@@ -0,0 +1,98 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import bz2
+import gzip
+import lzma
+import hashlib
+import pytest
+
+pytest.importorskip('freenas.dispatcher.fd')
+
+import freenas.cli.output
+from freenas.cli.namespace import CommandException
+from freenas.cli.transfer import upload
+
+
+PAYLOAD = os.urandom(256 * 1024) + b'\x1f\x8b' * 1024
+COMPRESS = {'gzip': gzip.compress, 'xz': lzma.compress, 'bz2': bz2.compress}
+
+
+@pytest.fixture(autouse=True)
+def formatter(monkeypatch):
+    # Progress is reported in the default output format
+    monkeypatch.setattr(freenas.cli.output, '_active_formatter', freenas.cli.output.get_formatter('ascii'))
+
+
+class FakeContext(object):
+    """
+    Runs the task by reading everything from the file descriptor it got.
+    """
+    def __init__(self):
+        self.received = bytearray()
+
+    def call_task_sync(self, name, fd):
+        while True:
+            data = os.read(fd.fd, 65536)
+            if not data:
+                break
+
+            self.received += data
+
+        return {'state': 'FINISHED', 'result': None}
+
+
+def write(tmp_path, data):
+    path = tmp_path / 'config.db'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('compression', sorted(COMPRESS))
+def test_upload_decompress(tmp_path, compression):
+    context = FakeContext()
+    path = write(tmp_path, COMPRESS[compression](PAYLOAD))
+    digest = upload(context, 'upload', 'database.restore', [None], path, compression)
+    assert context.received == PAYLOAD
+    assert digest == hashlib.sha256(PAYLOAD).hexdigest()
+
+
+@pytest.mark.parametrize('data', [gzip.compress(PAYLOAD), b'\x1f\x8b' + PAYLOAD], ids=['gzip', 'magic'])
+def test_upload_sends_file_as_is(tmp_path, data):
+    context = FakeContext()
+    upload(context, 'upload', 'database.restore', [None], write(tmp_path, data))
+    assert context.received == data
+
+
+@pytest.mark.parametrize('compression', ['xz', 'zip'])
+def test_upload_rejects_wrong_compression(tmp_path, compression):
+    context = FakeContext()
+    with pytest.raises(CommandException):
+        upload(context, 'upload', 'database.restore', [None], write(tmp_path, gzip.compress(PAYLOAD)), compression)
+
+    assert not context.received